@@ -6,10 +6,11 @@ import os
 
 # import pyqms.params
 import pyqms
-from pyqms.params import params_descriptions as params_descriptions
+from pyqms.params import get_params_descriptions
 import pprint
 
 if __name__ == "__main__":
+    params_descriptions = get_params_descriptions()
     print(
         """
         Formatting params into rst files for the docs
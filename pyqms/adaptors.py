@@ -50,8 +50,10 @@ PARAM_TYPE_LOOKUP = {
     "INTERNAL_PRECISION": int,
     "MAX_MOLECULES_PER_MATCH_BIN": int,
     "MZ_SCORE_PERCENTILE": float,
+    "EXHAUSTIVE_COMBO_SEARCH": bool,
     "SILAC_AAS_LOCKED_IN_EXPERIMENT": str,
     "BUILD_RESULT_INDEX": bool,
+    "STREAM_MATCH_SETS": bool,
     "MACHINE_OFFSET_IN_PPM": float,
 }
 
@@ -152,6 +154,9 @@ def _parse_evidence_and_format_fixed_labels(data=None, unimod_file_list=None):
         for k, v in data["params"][major_cat].items():
             if k == "NAME":
                 continue
+            # keys parsed at runtime are interned like the literal keys in
+            # pyqms.params
+            k = sys.intern(k)
             converted_value = PARAM_TYPE_LOOKUP[k](v)
             r["params"][k] = converted_value
 
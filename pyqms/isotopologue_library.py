@@ -20,16 +20,356 @@
 """
 
 from __future__ import absolute_import
+import array
+import os
 import sys
 import re
 import copy
 import bisect
+import collections.abc
+import functools
+import itertools
 import pyqms
+from pyqms.params import ParamBundle, validate_params
 import operator
+import shutil
+import tempfile
 import time
+import types
+import weakref
 import numpy as np
 from chemical_composition import ChemicalComposition
 
+_EPSILON = sys.float_info.epsilon
+# largest tmz span per tmz value for which _count_common_tmzs uses a bitmap
+_MAX_BITMAP_SPAN_PER_TMZ = 64
+
+
+def _convolve_element_envelope(
+    prev_pos, prev_abun, prev_mass, iso_pos, iso_abun, iso_mass, min_abundance
+):
+    """
+    Adds one atom to an element envelope, i.e. convolutes the envelope of
+    the previous level with the isotopic distribution of the element.
+
+    Args:
+        prev_pos, prev_abun, prev_mass (np.ndarray): positions, abundances
+            and masses of the previous envelope level
+        iso_pos, iso_abun, iso_mass (np.ndarray): positions, abundances
+            and masses of the isotopes of the element
+        min_abundance (float): params['ELEMENT_MIN_ABUNDANCE']
+
+    Returns:
+        tuple: positions, abundances and mean masses of the new envelope
+        level as well as the lowest and highest position with an abundance
+        above min_abundance (None if there is none).
+    """
+    new_pos = (prev_pos[:, np.newaxis] + iso_pos[np.newaxis, :]).ravel()
+    offset = new_pos.min()
+    bins = new_pos - offset
+    abun_sums = np.bincount(
+        bins, weights=(prev_abun[:, np.newaxis] * iso_abun[np.newaxis, :]).ravel()
+    )
+    mass_sums = np.bincount(
+        bins, weights=(prev_mass[:, np.newaxis] + iso_mass[np.newaxis, :]).ravel()
+    )
+    paths = np.bincount(bins)
+    occupied = np.flatnonzero(paths)
+    env_pos = occupied + offset
+    env_abun = abun_sums[occupied]
+    env_mass = mass_sums[occupied] / paths[occupied]
+    above_min_abundance = env_pos[env_abun > min_abundance]
+    if len(above_min_abundance) == 0:
+        min_pos, max_pos = None, None
+    else:
+        min_pos = int(above_min_abundance[0])
+        max_pos = int(above_min_abundance[-1])
+    return env_pos, env_abun, env_mass, min_pos, max_pos
+
+
+@functools.lru_cache(maxsize=1024)
+def _enrich_isotopic_distribution(
+    natural_distribution, target_percentile, enriched_isotope
+):
+    """
+    Cached core of IsotopologueLibrary._recalc_isotopic_distribution.
+
+    Args:
+        natural_distribution (tuple): tuples of mass, abundance and peak
+            position of the template element
+        target_percentile (float): Enrichment level [0 - 1.0]
+        enriched_isotope (int): enriched_isotope is int of mass,
+            e.g. 13 for '13C'
+
+    Returns:
+        tuple: new distribution, tuples of mass, abundance and peak position
+    """
+    new_distribution = []
+    total_other_isotope_abundance = 0
+
+    for mass, abundance, pos in natural_distribution:
+        if int(round(mass)) != enriched_isotope:
+            total_other_isotope_abundance += abundance
+            continue
+        natural_abundance = abundance
+
+    diff_in_abundance = natural_abundance - target_percentile
+    for mass, abundance, pos in natural_distribution:
+
+        share_in_difference = (
+            abundance * diff_in_abundance / total_other_isotope_abundance
+        )
+
+        if int(round(mass)) == enriched_isotope:
+            abundance = target_percentile
+        else:
+            abundance += share_in_difference
+        new_distribution.append((mass, abundance, pos))
+    return tuple(new_distribution)
+
+
+@functools.lru_cache(maxsize=1024)
+def _findall_regex(pattern, string):
+    """
+    Cached pattern.findall, e.g. for unimod strings shared by fixed labels.
+
+    Args:
+        pattern (re.Pattern): compiled regex, see IsotopologueLibrary.regex
+        string (str): string to parse
+
+    Returns:
+        tuple: all matches
+    """
+    return tuple(pattern.findall(string))
+
+
+@functools.lru_cache(maxsize=1024)
+def _match_regex(pattern, string):
+    """
+    Cached pattern.match, e.g. for isotope element strings like '15N'.
+
+    Args:
+        pattern (re.Pattern): compiled regex, see IsotopologueLibrary.regex
+        string (str): string to parse
+
+    Returns:
+        re.Match: match object or None
+    """
+    return pattern.match(string)
+
+
+def _score_peaks(mmz, mi, ri, cmz, ci, inv_mz_range, inv_i_range, mz_score_percentile):
+    """
+    Vectorized mScore calculation, see IsotopologueLibrary.score_matches
+    for details.
+
+    Args:
+        mmz, mi, ri, cmz, ci (np.ndarray): measured mz, measured intensity,
+            relative intensity, calculated mz and calculated intensity of
+            each scored peak. mmz and mi are NaN for unmatched peaks.
+        inv_mz_range (np.ndarray): 1 / (cmz * params['REL_MZ_RANGE'])
+        inv_i_range (np.ndarray): 1 / (1 + params['REL_I_RANGE'] - ri)
+        mz_score_percentile (float): weighting of mz score
+
+    Returns:
+        tuple: score and scaling factor
+    """
+    ri_sum = ri.sum()
+    matched = ~np.isnan(mmz)
+    # fully matched isotopologues are scored on the arrays as they are
+    if not matched.all():
+        mmz, mi, ri, cmz, ci, inv_mz_range, inv_i_range = (
+            column[matched]
+            for column in (mmz, mi, ri, cmz, ci, inv_mz_range, inv_i_range)
+        )
+    # NOTE: old_pyQms scaling is not weighted by rel_i
+    scaling_factor = float(np.dot(mi, ri)) / float(np.dot(ci, ri))
+    si = ci * scaling_factor
+    # errors beyond the allowed range are clipped to a local score of 0
+    # instead of being masked, peaks with a calculated mz or intensity of 0
+    # keep their initial local score of 0
+    local_mz_scores = np.zeros_like(cmz)
+    local_i_scores = np.zeros_like(si)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.maximum(
+            1 - np.abs(mmz - cmz) * inv_mz_range,
+            0,
+            out=local_mz_scores,
+            where=cmz > _EPSILON,
+        )
+        np.maximum(
+            1 - np.abs(mi - si) / si * inv_i_range,
+            0,
+            out=local_i_scores,
+            where=si > _EPSILON,
+        )
+    mz_score = np.dot(local_mz_scores, ri) / ri_sum
+    i_score = np.dot(local_i_scores, ri) / ri_sum
+    score = mz_score * mz_score_percentile + i_score * (1 - mz_score_percentile)
+    return float(score), scaling_factor
+
+
+def _sorted_tmz_array(tmzs):
+    """
+    Converts a set of transformed mz values into a sorted np.int64 array.
+    """
+    tmz_array = np.fromiter(tmzs, dtype=np.int64, count=len(tmzs))
+    tmz_array.sort()
+    return tmz_array
+
+
+def _expand_tmz_ranges(tmz_ranges):
+    """
+    Converts an array of lowest and highest transformed mz values, shape
+    (n, 2), into a sorted np.int64 array of all transformed mz values within
+    those ranges.
+    """
+    lengths = tmz_ranges[:, 1] - tmz_ranges[:, 0] + 1
+    range_offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    tmzs = np.repeat(tmz_ranges[:, 0], lengths) + (
+        np.arange(lengths.sum()) - range_offsets
+    )
+    return np.unique(tmzs)
+
+
+def _count_common_tmzs(tmzs_a, tmzs_b):
+    """
+    Counts the values two sorted np.int64 arrays without duplicates have
+    in common.
+
+    If both arrays cover a narrow tmz span, e.g. a spectrum sliced to the
+    mz range of a match set, the values of one array are flagged in a
+    bitmap over that span and looked up with the other array. This is an
+    exact test, i.e. there are no false positives like in a bloom filter.
+    Otherwise the smaller array is bisected into the larger one.
+    """
+    if len(tmzs_a) > len(tmzs_b):
+        tmzs_a, tmzs_b = tmzs_b, tmzs_a
+    if len(tmzs_a) == 0:
+        return 0
+    lowest_tmz = min(tmzs_a[0], tmzs_b[0])
+    span = max(tmzs_a[-1], tmzs_b[-1]) - lowest_tmz + 1
+    if span <= _MAX_BITMAP_SPAN_PER_TMZ * (len(tmzs_a) + len(tmzs_b)):
+        bitmap = np.zeros(span, dtype=bool)
+        bitmap[tmzs_b - lowest_tmz] = True
+        return int(np.count_nonzero(bitmap[tmzs_a - lowest_tmz]))
+    positions = np.minimum(np.searchsorted(tmzs_b, tmzs_a), len(tmzs_b) - 1)
+    return int(np.count_nonzero(tmzs_b[positions] == tmzs_a))
+
+
+class _SpectrumTmzLookup(collections.abc.Mapping):
+    """
+    Read only tmz lookup of a spectrum given as np.ndarray, see
+    IsotopologueLibrary._transform_spectrum.
+
+    Peaks are stored sorted by tmz (keeping the spectrum order within a
+    tmz) and the lists of mz and intensity tuples are only created for the
+    tmzs that are actually looked up.
+    """
+
+    def __init__(self, tmzs, starts, mzs, intensities):
+        self._tmzs = tmzs
+        self._starts = starts
+        self._mzs = mzs
+        self._intensities = intensities
+
+    def __getitem__(self, tmz):
+        index = bisect.bisect_left(self._tmzs, tmz)
+        if index == len(self._tmzs) or self._tmzs[index] != tmz:
+            raise KeyError(tmz)
+        start = self._starts[index]
+        end = self._starts[index + 1]
+        return list(zip(self._mzs[start:end], self._intensities[start:end]))
+
+    def __iter__(self):
+        return iter(self._tmzs)
+
+    def __len__(self):
+        return len(self._tmzs)
+
+
+class _MatchSetFiles(object):
+    """
+    Temporary files holding the tmzs and tmz_ranges of all streamed match
+    sets, see params['STREAM_MATCH_SETS'].
+
+    The arrays of each key are appended to one file, which is memory-mapped
+    once on the first access, so that matching does not open a file per
+    match set. The files are removed when the library is garbage collected.
+    """
+
+    def __init__(self, library):
+        self.directory = tempfile.mkdtemp(prefix="pyqms_match_sets_")
+        weakref.finalize(library, shutil.rmtree, self.directory, ignore_errors=True)
+        self._sizes = {}
+        self._arrays = {}
+
+    def _file_name(self, key):
+        return os.path.join(self.directory, "{0}.bin".format(key))
+
+    def append(self, key, array):
+        """
+        Appends an np.int64 array to the file of key.
+
+        Returns:
+            tuple: offset and shape of the array, see load
+        """
+        offset = self._sizes.get(key, 0)
+        with open(self._file_name(key), "ab") as io:
+            io.write(np.ascontiguousarray(array, dtype=np.int64).tobytes())
+        self._sizes[key] = offset + array.size
+        return offset, array.shape
+
+    def load(self, key, offset, shape):
+        """
+        Returns a read only view of an array stored with append.
+        """
+        size = int(np.prod(shape))
+        if size == 0:
+            return np.empty(shape, dtype=np.int64)
+        if key not in self._arrays:
+            self._arrays[key] = np.memmap(
+                self._file_name(key), dtype=np.int64, mode="r"
+            )
+        return self._arrays[key][offset : offset + size].reshape(shape)
+
+
+class _StreamedMatchSet(collections.abc.Mapping):
+    """
+    Match set whose tmzs and tmz_ranges are stored in a _MatchSetFiles and
+    only loaded when accessed, see params['STREAM_MATCH_SETS'].
+
+    The loaded arrays are kept, i.e. files are memory-mapped only once.
+    Pickled match sets hold the arrays themselves, since the temporary files
+    are removed together with the library.
+    """
+
+    def __init__(self, match_set, files, streamed):
+        self._match_set = match_set
+        self._files = files
+        # key: (offset, shape) in files
+        self._streamed = streamed
+        self._arrays = {}
+
+    def __getitem__(self, key):
+        if key in self._streamed:
+            if key not in self._arrays:
+                self._arrays[key] = self._files.load(key, *self._streamed[key])
+            return self._arrays[key]
+        return self._match_set[key]
+
+    def __iter__(self):
+        return itertools.chain(self._match_set, self._streamed)
+
+    def __len__(self):
+        return len(self._match_set) + len(self._streamed)
+
+    def __reduce__(self):
+        match_set = dict(self._match_set)
+        for key in self._streamed:
+            match_set[key] = np.array(self[key])
+        return (dict, (match_set,))
+
 
 class IsotopologueLibrary(dict):
     """
@@ -106,17 +446,9 @@ class IsotopologueLibrary(dict):
                     (('N', '0.000'),): {
                         # charge :
                         1: {
-                            # all transformed mz values
-                            'atmzs': {
-                                800443,
-                                800444,
-                                # ... skipped
-                                803459,
-                                803460,
-                                803461
-                            },
-                            # theoretical mz values
-                            'mz': [
+                            # theoretical mz values, stored as np.array
+                            # like abun, mass and relabun
+                            'mz': np.array([
                                 800.4472772254203,
                                 801.450389542063,
                                 802.4536114854914,
@@ -125,43 +457,33 @@ class IsotopologueLibrary(dict):
                                 805.463171867346,
                                 806.4631454917885,
                                 807.4676949759603
-                            ],
-                            # transformed mz values within error
-                            # packages are on on peak level
-                            'tmzs': [
-                                {
-                                    800443,
-                                    800444,
-                                    # ... skipped
-                                    800451
-                                },
-                                {
-                                    801446,
-                                    801447,
-                                    # ... skipped
-                                    801454
-                                },
-                                {
-                                    802450,
-                                    802451,
-                                    # ... skipped
-                                    802458
-                                },
-                                {
-                                803453,
-                                    803454,
-                                    803455,
-                                    # ... skipped
-                                    803461
-                                },
-                                None,
-                                None,
-                                None,
-                                None
-                            ]
+                            ]),
+                            # theoretical mz values of the c_peaks
+                            'c_peak_mz': np.array([
+                                800.4472772254203,
+                                801.450389542063,
+                                802.4536114854914,
+                                803.4568170275203
+                            ]),
+                            # 1 / (c_peak_mz * REL_MZ_RANGE)
+                            'c_peak_inv_mz_range': np.array([
+                                249.86030397062166,
+                                249.54757351141478,
+                                249.23559086457678,
+                                248.92439240222353
+                            ]),
+                            # transformed mz values within error as
+                            # np.int64 array of lowest and highest value,
+                            # one row per c_peak (see c_peak_indices)
+                            'tmzs': np.array([
+                                [800443, 800451],
+                                [801446, 801454],
+                                [802450, 802458],
+                                [803453, 803461]
+                            ])
                         },
                         # charge independent information
-                         'abun': [
+                        'abun': np.array([
                             64799,
                             26251,
                             7164,
@@ -170,19 +492,36 @@ class IsotopologueLibrary(dict):
                             20,
                             1,
                             0
-                        ],
-                        'c_peak_pos': [
+                        ]),
+                        # -1 for peaks that are not c_peaks
+                        'c_peak_pos': np.array([
                             0,
                             1,
                             2,
                             3,
-                            None,
-                            None,
-                            None,
-                            None
-                        ],
+                            -1,
+                            -1,
+                            -1,
+                            -1
+                        ]),
+                        'c_peak_indices': [0, 1, 2, 3],
+                        # abun and relabun of the c_peaks as float arrays
+                        'c_peak_abun': np.array([64799., 26251., 7164., 1456.]),
+                        'c_peak_relabun': np.array([
+                            1.0,
+                            0.40511743373159037,
+                            0.11054965400744385,
+                            0.022466784140529883
+                        ]),
+                        # 1 / (1 + REL_I_RANGE - c_peak_relabun)
+                        'c_peak_inv_i_range': np.array([
+                            5.000000000000001,
+                            1.2580474681870528,
+                            0.9178940588512444,
+                            0.8492329443718577
+                        ]),
                         'isot': [],
-                        'mass': [
+                        'mass': np.array([
                             799.3599640346001,
                             800.3629760500413,
                             801.3660976813065,
@@ -191,9 +530,9 @@ class IsotopologueLibrary(dict):
                             804.3753571372156,
                             805.3752307742944,
                             806.3796798135622
-                        ],
+                        ]),
                         'n_c_peaks': 4.0,
-                        'relabun': [
+                        'relabun': np.array([
                             1.0,
                             0.40511743373159037,
                             0.11054965400744385,
@@ -202,7 +541,7 @@ class IsotopologueLibrary(dict):
                             0.0003019650321460501,
                             7.716705830708012e-06,
                             3.639837831552297e-08
-                        ]
+                        ])
                     }
                 }
             }
@@ -225,10 +564,18 @@ class IsotopologueLibrary(dict):
         assert molecules is not None, "require list of molecules"
         assert charges is not None, "require list of charges"
 
-        self.params = copy.deepcopy(pyqms.params)
+        # read only mappings in pyqms.params are copied as dicts
+        self.params = copy.deepcopy(
+            {
+                key: dict(value) if isinstance(value, types.MappingProxyType) else value
+                for key, value in pyqms.params.items()
+            }
+        )
         if params is not None:
             self.params.update(params)
-        self.zero_labeled_percentile = self.params["PERCENTILE_FORMAT_STRING"].format(0)
+            validate_params(self.params)
+        self._formated_percentiles = {}
+        self.zero_labeled_percentile = self._format_percentile(0)
 
         if metabolic_labels is None or metabolic_labels == {}:
             metabolic_labels = {"15N": [0.0]}
@@ -271,6 +618,7 @@ class IsotopologueLibrary(dict):
                                                 """,
                 re.VERBOSE,
             ),
+            "<aa><state>": re.compile(r"(?P<AA>[A-Z])(?P<state>[0-9]+)"),
         }
         self.aa_compositions = {}
         self.isotopic_distributions = {}
@@ -278,6 +626,7 @@ class IsotopologueLibrary(dict):
         self.formulas_sorted_by_mz = []
         self.match_sets = {}
         self.match_set_mz_range = [None, None]
+        self._match_set_files = None
 
         self._cache_kb()  # knowledge_base information
         if self.verbose:
@@ -349,21 +698,13 @@ class IsotopologueLibrary(dict):
             if trivial_names is not None:
                 molecule_trivial_name = trivial_names.get(molecule, None)
                 if molecule_trivial_name is not None:
-                    try:
-                        self.lookup["formula to trivial name"][formula]
-                    except:
-                        self.lookup["formula to trivial name"][formula] = []
-                    self.lookup["formula to trivial name"][formula].append(
-                        molecule_trivial_name
-                    )
+                    self.lookup["formula to trivial name"].setdefault(
+                        formula, []
+                    ).append(molecule_trivial_name)
                 else:
                     print("No trivial name for molecule", molecule)
             self.lookup["molecule to formula"][molecule] = formula
-            try:
-                self.lookup["formula to molecule"][formula]
-            except:
-                self.lookup["formula to molecule"][formula] = []
-            self.lookup["formula to molecule"][formula].append(molecule)
+            self.lookup["formula to molecule"].setdefault(formula, []).append(molecule)
             # this is required since we translate all input molecules
             # (`MAAGALOH+O` or simple `+H2O`) to their respective formula using
             # hill_notation to avoid any mismatches
@@ -381,7 +722,7 @@ class IsotopologueLibrary(dict):
                     # that need to be considered ...
                     # see 806
                     pattern = self.regex["<isotope><element>"]
-                    match = pattern.match(element)
+                    match = _match_regex(pattern, element)
                     try:
                         enriched_isotope = int(round(float(match.group("isotope"))))
                     except:
@@ -467,7 +808,7 @@ class IsotopologueLibrary(dict):
         for element in list(self._highest_element_count.keys()):
             if element.isalpha() is False:
                 pattern = self.regex["<isotope><element>"]
-                match = pattern.match(element)
+                match = _match_regex(pattern, element)
                 enriched_isotope = int(round(float(match.group("isotope"))))
                 template_element = match.group("element")
                 if template_element not in self._highest_element_count.keys():
@@ -515,6 +856,11 @@ class IsotopologueLibrary(dict):
             # Building isotopologues ...
             #
             number_of_formulas = len(self.keys())
+            # the machine offset is applied as one factor, see
+            # ParamBundle.MACHINE_OFFSET_FACTOR
+            machine_offset_factor = ParamBundle.from_dict(
+                self.params
+            ).MACHINE_OFFSET_FACTOR
             for index, formula in enumerate(self.keys()):
                 if self.verbose:
                     print(
@@ -562,7 +908,7 @@ class IsotopologueLibrary(dict):
                                 if (
                                     percentile_element == isotope_less_element
                                     and label_percentile
-                                    == self.params["PERCENTILE_FORMAT_STRING"].format(
+                                    == self._format_percentile(
                                         self.params[
                                             "FIXED_LABEL_ISOTOPE_ENRICHMENT_LEVELS"
                                         ][element]
@@ -645,6 +991,23 @@ class IsotopologueLibrary(dict):
                             label_percentile
                         ][level]["minPos"]
 
+                    # abundances and masses of each element envelope as
+                    # plain lists, index 0 corresponds to minPos
+                    element_envs = {}
+                    for element, (label_percentile, level) in current_pt_dep[
+                        "element_stats"
+                    ].items():
+                        element_env = self.element_trees[element][label_percentile][
+                            level
+                        ]
+                        env_slice = slice(
+                            element_env["minPos"] - element_env["pos"][0],
+                            element_env["maxPos"] - element_env["pos"][0] + 1,
+                        )
+                        element_envs[element] = (
+                            element_env["abun"][env_slice].tolist(),
+                            element_env["mass"][env_slice].tolist(),
+                        )
                     tmp = {}
                     for combo in self._create_combinations(
                         current_pt_dep["not_labeled_element_combos"]
@@ -655,27 +1018,21 @@ class IsotopologueLibrary(dict):
                             + final_local_zero_isotopic_pos
                         )
                         # print(combo)
-                        try:
-                            tmp[isotope_pos]
-                        except:
-                            tmp[isotope_pos] = {"abun": [], "mass": []}
+                        if isotope_pos not in tmp:
+                            # running sums of abundances and of
+                            # abundance weighted masses
+                            tmp[isotope_pos] = {"abun": 0, "weighted_mass": 0}
                         abun = 1
                         mass = 0
                         for element, pos in combo:
-                            label_percentile, level = current_pt_dep["element_stats"][
-                                element
-                            ]
-                            min_pos = self.element_trees[element][label_percentile][
-                                level
-                            ]["minPos"]
+                            env_abun, env_mass = element_envs[element]
                             try:
-                                abun *= self.element_trees[element][label_percentile][
-                                    level
-                                ]["env"][pos + min_pos]["abun"]
-                                mass += self.element_trees[element][label_percentile][
-                                    level
-                                ]["env"][pos + min_pos]["mass"]
+                                abun *= env_abun[pos]
+                                mass += env_mass[pos]
                             except:
+                                label_percentile, level = current_pt_dep[
+                                    "element_stats"
+                                ][element]
                                 print(
                                     "Can we use the limits ?",
                                     self.element_trees[element][label_percentile][
@@ -698,43 +1055,43 @@ class IsotopologueLibrary(dict):
                                 # print('self.element_trees[{0}][{1}][{2}]'.format(element,label_percentile,level),self.element_trees[element][label_percentile][level])
                                 # print( self.element_trees[element][label_percentile][level]['env'][pos] )
                                 sys.exit(1)
-                        tmp[isotope_pos]["abun"].append(abun)
-                        tmp[isotope_pos]["mass"].append(mass)
+                        tmp[isotope_pos]["abun"] += abun
+                        tmp[isotope_pos]["weighted_mass"] += mass * abun
                     self[formula]["env"][label_percentile_tuple] = {
                         "isot": [],
-                        "mass": [],
-                        "abun": [],
-                        "relabun": [],
+                        "mass": array.array("d"),
+                        "abun": array.array("q"),
+                        "relabun": array.array("d"),
                         "c_peak_pos": [],
                         # ^ peaks with higher intensities than
                         # self.params['MIN_REL_PEAK_INTENSITY_FOR_MATCHING']
+                        "c_peak_indices": [],
+                        # ^ index n of each c_peak, aligned with tmzs
                         "n_c_peaks": 0,
                         # number of matchable peaks
                     }
-                    for charge in self.charges:
-                        self[formula]["env"][label_percentile_tuple][charge] = {
-                            "mz": [],  # all mz values
-                            "tmzs": [],  # transformed mz sets incl. measured precision, pymzml hasPeak style. Each peak one set
-                            "atmzs": set(),  # all transformed mz sets together
-                        }
-
-                    max_intensity = 0
-                    for isotope_pos in sorted(tmp.keys()):
-                        total_local_intensity = sum(tmp[isotope_pos]["abun"])
-                        if total_local_intensity > max_intensity:
-                            max_intensity = total_local_intensity
+                    sorted_isotope_positions = sorted(tmp.keys())
+                    total_local_intensities = [
+                        tmp[isotope_pos]["abun"]
+                        for isotope_pos in sorted_isotope_positions
+                    ]
+                    max_intensity = max(total_local_intensities)
+                    # params read for every isotope peak
+                    min_rel_peak_intensity = self.params[
+                        "MIN_REL_PEAK_INTENSITY_FOR_MATCHING"
+                    ]
+                    intensity_transformation_factor = self.params[
+                        "INTENSITY_TRANSFORMATION_FACTOR"
+                    ]
 
-                    for isotope_pos in sorted(tmp.keys()):
-                        total_local_intensity = sum(tmp[isotope_pos]["abun"])
+                    for isotope_pos, total_local_intensity in zip(
+                        sorted_isotope_positions, total_local_intensities
+                    ):
                         if total_local_intensity < sys.float_info.epsilon:
                             continue
-                        total_local_mass = 0
-                        for n, mass in enumerate(tmp[isotope_pos]["mass"]):
-                            total_local_mass += (
-                                mass
-                                * tmp[isotope_pos]["abun"][n]
-                                / float(total_local_intensity)
-                            )
+                        total_local_mass = tmp[isotope_pos]["weighted_mass"] / float(
+                            total_local_intensity
+                        )
 
                         self[formula]["env"][label_percentile_tuple]["mass"].append(
                             total_local_mass
@@ -743,7 +1100,7 @@ class IsotopologueLibrary(dict):
                             int(
                                 round(
                                     total_local_intensity
-                                    * self.params["INTENSITY_TRANSFORMATION_FACTOR"]
+                                    * intensity_transformation_factor
                                 )
                             )
                         )
@@ -753,12 +1110,7 @@ class IsotopologueLibrary(dict):
                         self[formula]["env"][label_percentile_tuple]["relabun"].append(
                             relative_intensity
                         )
-                        c_peak = False
-                        if (
-                            relative_intensity
-                            >= self.params["MIN_REL_PEAK_INTENSITY_FOR_MATCHING"]
-                        ):
-                            c_peak = True
+                        c_peak = relative_intensity >= min_rel_peak_intensity
 
                         if c_peak:
                             self[formula]["env"][label_percentile_tuple][
@@ -767,6 +1119,16 @@ class IsotopologueLibrary(dict):
                             self[formula]["env"][label_percentile_tuple][
                                 "c_peak_pos"
                             ].append(isotope_pos)
+                            self[formula]["env"][label_percentile_tuple][
+                                "c_peak_indices"
+                            ].append(
+                                len(
+                                    self[formula]["env"][label_percentile_tuple][
+                                        "c_peak_pos"
+                                    ]
+                                )
+                                - 1
+                            )
                             # NOTE: not sure if tuple is needed ...
                             # isotope_pos is not used anywhere after here ?
                         else:
@@ -774,62 +1136,53 @@ class IsotopologueLibrary(dict):
                                 "c_peak_pos"
                             ].append(None)
 
-                        for charge in self.charges:
-                            # if charge > 0:
-                            #     ionization_spec = pyqms.knowledge_base.PROTON
-                            # else:
-                            #     ionization_spec = pyqms.knowledge_base.ELECTRON
-                            # ^--- negative mode = proton loss not electron addition
-
-                            mz = (
-                                total_local_mass + charge * pyqms.knowledge_base.PROTON
-                            ) / float(abs(charge))
-
-                            #
-                            # MACHINE ERROR
-                            #
-                            if self.params["MACHINE_OFFSET_IN_PPM"] != 0:
-                                mz = (
-                                    mz
-                                    + mz * 1e-6 * self.params["MACHINE_OFFSET_IN_PPM"]
-                                )
-
-                            self[formula]["env"][label_percentile_tuple][charge][
-                                "mz"
-                            ].append(mz)
-                            if c_peak:
-                                tmz_set = self._transform_mz_to_set(mz)
-                                self[formula]["env"][label_percentile_tuple][charge][
-                                    "tmzs"
-                                ].append(tmz_set)
-                                self[formula]["env"][label_percentile_tuple][charge][
-                                    "atmzs"
-                                ] |= tmz_set
-                            else:
-                                self[formula]["env"][label_percentile_tuple][charge][
-                                    "tmzs"
-                                ].append(None)
-                                # now tmzs list has the same length > index n holds
-
+                    # the peak lists are stored as np.ndarrays, c_peak_pos
+                    # is -1 for peaks that are not c_peaks
+                    env = self[formula]["env"][label_percentile_tuple]
+                    env["mass"] = np.array(env["mass"], dtype=np.float64)
+                    env["abun"] = np.array(env["abun"], dtype=np.int64)
+                    env["relabun"] = np.array(env["relabun"], dtype=np.float64)
+                    env["c_peak_pos"] = np.array(
+                        [-1 if pos is None else pos for pos in env["c_peak_pos"]],
+                        dtype=np.int64,
+                    )
+                    # dense float arrays of the c_peaks, used for scoring
+                    c_peak_indices = env["c_peak_indices"]
+                    env["c_peak_relabun"] = env["relabun"][c_peak_indices]
+                    env["c_peak_abun"] = env["abun"][c_peak_indices].astype(np.float64)
+                    # reciprocal error ranges, scoring multiplies instead
+                    # of dividing by them
+                    env["c_peak_inv_i_range"] = 1.0 / (
+                        1.0 + self.params["REL_I_RANGE"] - env["c_peak_relabun"]
+                    )
+                    for charge in self.charges:
+                        # if charge > 0:
+                        #     ionization_spec = pyqms.knowledge_base.PROTON
+                        # else:
+                        #     ionization_spec = pyqms.knowledge_base.ELECTRON
+                        # ^--- negative mode = proton loss not electron addition
+                        env[charge] = {
+                            # all mz values
+                            "mz": (env["mass"] + charge * pyqms.knowledge_base.PROTON)
+                            / float(abs(charge))
+                        }
                         #
-                        # now add the ranges to the global list
+                        # MACHINE ERROR
                         #
-                    for charge in self.charges:
-                        # try:
-                        lower_mz = self[formula]["env"][label_percentile_tuple][charge][
-                            "mz"
-                        ][0]
-                        # except:
-                        #     print( charge )
-                        #     print( formula )
-                        #     print( self[ formula ]['env'][label_percentile_tuple] )
-                        #     exit(1)
-                        lower_mz = self[formula]["env"][label_percentile_tuple][charge][
-                            "mz"
-                        ][0]
-                        upper_mz = self[formula]["env"][label_percentile_tuple][charge][
-                            "mz"
-                        ][-1]
+                        if machine_offset_factor != 1.0:
+                            env[charge]["mz"] *= machine_offset_factor
+                        env[charge]["c_peak_mz"] = env[charge]["mz"][c_peak_indices]
+                        env[charge]["c_peak_inv_mz_range"] = 1.0 / (
+                            env[charge]["c_peak_mz"] * self.params["REL_MZ_RANGE"]
+                        )
+                        # transformed mz ranges incl. measured precision,
+                        # pymzml hasPeak style. tmzs only hold c_peaks, i.e.
+                        # tmzs[k] belongs to peak index c_peak_indices[k]
+                        env[charge]["tmzs"] = self._transform_mzs_to_ranges(
+                            env[charge]["c_peak_mz"]
+                        )
+                        lower_mz = float(env[charge]["mz"][0])
+                        upper_mz = float(env[charge]["mz"][-1])
 
                         if self.params["LOWER_MZ_LIMIT"] <= lower_mz:
                             if upper_mz <= self.params["UPPER_MZ_LIMIT"]:
@@ -867,23 +1220,22 @@ class IsotopologueLibrary(dict):
             self.formulas_sorted_by_mz.sort()
 
             number_of_theoretical_formulas = len(self.formulas_sorted_by_mz)
-            for package_number, raw_index in enumerate(
-                range(
-                    0,
-                    number_of_theoretical_formulas,
-                    self.params["MAX_MOLECULES_PER_MATCH_BIN"],
-                )
+            package_starts = np.arange(
+                0,
+                number_of_theoretical_formulas,
+                self.params["MAX_MOLECULES_PER_MATCH_BIN"],
+            )
+            package_ends = np.minimum(
+                package_starts + self.params["MAX_MOLECULES_PER_MATCH_BIN"],
+                number_of_theoretical_formulas,
+            )
+            for package_number, (raw_index, next_raw_index) in enumerate(
+                zip(package_starts.tolist(), package_ends.tolist())
             ):
-                try:
-                    next_raw_index = (
-                        raw_index + self.params["MAX_MOLECULES_PER_MATCH_BIN"]
-                    )
-                    self.formulas_sorted_by_mz[next_raw_index]
-                except:
-                    next_raw_index = number_of_theoretical_formulas
                 self.match_sets[package_number] = {
                     "ids": [raw_index, next_raw_index],
-                    "tmzs": set(),
+                    "tmzs": [],
+                    "range_offsets": [0],
                     "mz_range": [None, None],
                 }
                 for index in range(raw_index, next_raw_index):
@@ -894,10 +1246,15 @@ class IsotopologueLibrary(dict):
                         label_percentile_tuple,
                         formula,
                     ) = self.formulas_sorted_by_mz[index]
+                    tmz_ranges = self[formula]["env"][label_percentile_tuple][charge][
+                        "tmzs"
+                    ]
+                    self.match_sets[package_number]["tmzs"].append(tmz_ranges)
+                    self.match_sets[package_number]["range_offsets"].append(
+                        self.match_sets[package_number]["range_offsets"][-1]
+                        + len(tmz_ranges)
+                    )
                     if self.params["MAX_MOLECULES_PER_MATCH_BIN"] != 1:
-                        self.match_sets[package_number]["tmzs"] |= self[formula]["env"][
-                            label_percentile_tuple
-                        ][charge]["atmzs"]
                         if (
                             self.match_sets[package_number]["mz_range"][0] is None
                             or lower_mz < self.match_sets[package_number]["mz_range"][0]
@@ -909,11 +1266,23 @@ class IsotopologueLibrary(dict):
                         ):
                             self.match_sets[package_number]["mz_range"][1] = upper_mz
                     else:
-                        self.match_sets[package_number]["tmzs"] = self[formula]["env"][
-                            label_percentile_tuple
-                        ][charge]["atmzs"]
                         self.match_sets[package_number]["mz_range"][0] = lower_mz
                         self.match_sets[package_number]["mz_range"][1] = upper_mz
+                # the tmz ranges of all isotopologues are concatenated, so
+                # that match_all counts the matched peaks of a whole package
+                # at once, range_offsets[n] is the first range of the n-th
+                # isotopologue. Sorted tmz arrays allow fast intersections.
+                self.match_sets[package_number]["tmz_ranges"] = np.concatenate(
+                    self.match_sets[package_number]["tmzs"]
+                )
+                self.match_sets[package_number]["range_offsets"] = np.array(
+                    self.match_sets[package_number]["range_offsets"], dtype=np.int64
+                )
+                self.match_sets[package_number]["tmzs"] = _expand_tmz_ranges(
+                    self.match_sets[package_number]["tmz_ranges"]
+                )
+                if self.params["STREAM_MATCH_SETS"]:
+                    self._stream_match_set(package_number)
 
                 # print(package_number, raw_index, next_raw_index)
                 # print(self.formulas_sorted_by_mz[raw_index:next_raw_index])
@@ -955,6 +1324,29 @@ class IsotopologueLibrary(dict):
                     )
         return
 
+    def _stream_match_set(self, package_number):
+        """
+        Appends the tmzs and tmz_ranges of a match set to temporary files
+        and replaces the match set with a proxy that loads them only on
+        access.
+
+        Args:
+            package_number (int): match set to stream to disk
+
+        Used if params['STREAM_MATCH_SETS'] is True to bound the RAM required
+        for libraries with many molecules.
+        """
+        if self._match_set_files is None:
+            self._match_set_files = _MatchSetFiles(self)
+        match_set = self.match_sets[package_number]
+        streamed = {}
+        for key in ("tmzs", "tmz_ranges"):
+            streamed[key] = self._match_set_files.append(key, match_set.pop(key))
+        self.match_sets[package_number] = _StreamedMatchSet(
+            match_set, self._match_set_files, streamed
+        )
+        return
+
     def _build_label_percentile_tuples(self):
         """
         Builds labled_percentile tuples list, which is stored in
@@ -980,13 +1372,13 @@ class IsotopologueLibrary(dict):
         ):
             label_tmp_dict = {}
             for entry in combo:
-                match = pattern.match(entry[0])
+                match = _match_regex(pattern, entry[0])
                 # isotope = match.group('isotope')
                 element = match.group("element")
                 index = entry[1]
-                label_tmp_dict[element] = self.params[
-                    "PERCENTILE_FORMAT_STRING"
-                ].format(self.metabolic_labels[entry[0]][index])
+                label_tmp_dict[element] = self._format_percentile(
+                    self.metabolic_labels[entry[0]][index]
+                )
 
             # element_list, label_percentiles = zip(*sorted(label_tmp_dict.items()))
             self.labled_percentiles.append(tuple(sorted(label_tmp_dict.items())))
@@ -1029,7 +1421,7 @@ class IsotopologueLibrary(dict):
         self, input_list, all_combos=None, current_combo=None, pos=0
     ):
         """
-        Recursive combination generator.
+        Combination generator.
 
         Creates a list of all combinations with the respective position of
         an element in a given list. Instead of creating long lists with all
@@ -1055,24 +1447,20 @@ class IsotopologueLibrary(dict):
         Returns:
             all possible combinations of elements of those lists.
         """
-        # print( 'cc ',input_list, all_combos)
         if all_combos is None:
             all_combos = []
         if current_combo is None:
             current_combo = []
         if len(input_list) != 0:
-            token, number_of_elements = input_list[pos]
-            for index in range(number_of_elements):
-                extend_list = current_combo + [(token, index)]
-                if pos >= len(input_list) - 1:
-                    all_combos.append(extend_list)
-                else:
-                    all_combos = self._create_combinations(
-                        input_list,
-                        all_combos=all_combos,
-                        current_combo=extend_list,
-                        pos=pos + 1,
-                    )
+            all_combos.extend(
+                current_combo + list(combo)
+                for combo in itertools.product(
+                    *[
+                        [(token, index) for index in range(number_of_elements)]
+                        for token, number_of_elements in input_list[pos:]
+                    ]
+                )
+            )
         return all_combos
 
     def _create_element_trees(self):
@@ -1087,15 +1475,13 @@ class IsotopologueLibrary(dict):
                 '<element>': {
                     '<label incorporation efficiency>': {
                         '<number of atoms>': {
-                            'env': {
-                                # 0 corresponds to monoisotopic peak
-                                # 1 means one additional quasi "neutron"
-                                '<isotopic peak position>' : {
-                                    'abundance': '<probability of isotopic peak>',
-                                    'mass'     : '<mass of isotopic peak>'
-                                },
-                                # '...' : '...',
-                            },
+                            # contiguous arrays, index i corresponds to
+                            # isotopic peak position pos[0] + i
+                            # 0 corresponds to monoisotopic peak
+                            # 1 means one additional quasi "neutron"
+                            'pos' : '<np.ndarray of isotopic peak positions>',
+                            'abun': '<np.ndarray of probabilities of isotopic peaks>',
+                            'mass': '<np.ndarray of masses of isotopic peaks>',
                             'maxPos': '<highest isotopic peak position where peak probability is above params['ELEMENT_MIN_ABUNDANCE']>',
                             'minPos': '<lowest isotopic peak position where peak probability is above params['ELEMENT_MIN_ABUNDANCE']>'
                             },
@@ -1117,27 +1503,27 @@ class IsotopologueLibrary(dict):
                         *self._range_for_elements_with_two_isotopes
                     )
                 )
-            # create factorial_cache
-            self._factorial_cache = {0: 1}
-            for n in range(1, max_number + 2):
-                self._factorial_cache[n] = self._factorial_cache[n - 1] * n
+            # create factorial_cache, object dtype keeps arbitrary precision ints
+            self._factorial_cache = np.empty(max_number + 2, dtype=object)
+            self._factorial_cache[0] = 1
+            self._factorial_cache[1:] = np.multiply.accumulate(
+                np.arange(1, max_number + 2, dtype=object)
+            )
 
             # create binomial_cache
             self._binomial_cache = {}
             for n in range(min_number, max_number + 1):
-                tmpCache = []
                 midEnvPos = int(n / 2.0) + 1
-                for k in range(midEnvPos):
-                    tmpCache.append(
-                        self._factorial_cache[n]
-                        // (self._factorial_cache[k] * self._factorial_cache[n - k])
-                    )
+                k = np.arange(midEnvPos)
+                tmpCache = self._factorial_cache[n] // (
+                    self._factorial_cache[k] * self._factorial_cache[n - k]
+                )
                 if n % 2 == 0:  # uneven number of envelope positions
-                    self._binomial_cache[n] = (
-                        tmpCache + sorted(tmpCache, reverse=True)[1:]
+                    self._binomial_cache[n] = np.concatenate(
+                        (tmpCache, tmpCache[-2::-1])
                     )
                 else:  # 1 -> even number of envelope positions
-                    self._binomial_cache[n] = tmpCache + sorted(tmpCache, reverse=True)
+                    self._binomial_cache[n] = np.concatenate((tmpCache, tmpCache[::-1]))
         self.element_trees = {}
         for element, count in self._highest_element_count.items():
             assert (
@@ -1147,24 +1533,17 @@ class IsotopologueLibrary(dict):
             for label_percentile in sorted(
                 self.isotopic_distributions[element].keys(), reverse=True
             ):
+                local_iso_dist = self.isotopic_distributions[element][label_percentile]
+                masses, abundances, positions = zip(*local_iso_dist)
                 self.element_trees[element][label_percentile] = {
                     1: {
-                        "maxPos": self.isotopic_distributions[element][
-                            label_percentile
-                        ][-1][2],
-                        "minPos": self.isotopic_distributions[element][
-                            label_percentile
-                        ][0][2],
-                        "env": {},
+                        "maxPos": local_iso_dist[-1][2],
+                        "minPos": local_iso_dist[0][2],
+                        "pos": np.array(positions, dtype=np.int64),
+                        "abun": np.array(abundances, dtype=np.float64),
+                        "mass": np.array(masses, dtype=np.float64),
                     }
                 }
-                for mass, abundance, envPos in self.isotopic_distributions[element][
-                    label_percentile
-                ]:
-                    self.element_trees[element][label_percentile][1]["env"][envPos] = {
-                        "mass": mass,
-                        "abun": abundance,
-                    }
 
             for label_percentile in self.isotopic_distributions[element].keys():
                 if self.verbose:
@@ -1180,17 +1559,14 @@ class IsotopologueLibrary(dict):
                     for level in range(2, count + 1):
                         previous_level_mass = self.element_trees[element][
                             label_percentile
-                        ][level - 1]["env"][0]["mass"]
+                        ][level - 1]["mass"]
                         isotope_mass = self.isotopic_distributions[element][
                             label_percentile
                         ][0][0]
                         self.element_trees[element][label_percentile][level] = {
-                            "env": {
-                                0: {
-                                    "abun": 1,
-                                    "mass": previous_level_mass + isotope_mass,
-                                }
-                            },
+                            "pos": np.zeros(1, dtype=np.int64),
+                            "abun": np.ones(1, dtype=np.float64),
+                            "mass": previous_level_mass + isotope_mass,
                             "maxPos": 0,
                             "minPos": 0,
                         }
@@ -1231,18 +1607,8 @@ class IsotopologueLibrary(dict):
         # print( 'calculating two for', element, label_percentile, count )
         for n in range(min_number_of_elements, count + 1):
             # iterate over levels
-            self.element_trees[element][label_percentile][n] = {
-                "env": {},
-                "maxPos": None,
-                "minPos": None,
-            }
-            local_element_tree_pos = self.element_trees[element][label_percentile][n]
-            a = local_iso_dist[0][1]
-            b = local_iso_dist[1][1]
-            aMass = local_iso_dist[0][0]
-            bMass = local_iso_dist[1][0]
-            somewhereNotZero = False
-            endingZero = False
+            local_element_tree_pos = {"maxPos": None, "minPos": None}
+            first_k = beginningZeroK
             if n not in self._binomial_cache:
                 print(
                     "expected, {0} and got only {1} in element {2}".format(
@@ -1250,12 +1616,20 @@ class IsotopologueLibrary(dict):
                     )
                 )
                 exit(1)
+            # masses of positions that are never calculated stay NaN
+            env_abun = np.zeros(len(self._binomial_cache[n]) - first_k)
+            env_mass = np.full(len(self._binomial_cache[n]) - first_k, np.nan)
+            a = local_iso_dist[0][1]
+            b = local_iso_dist[1][1]
+            aMass = local_iso_dist[0][0]
+            bMass = local_iso_dist[1][0]
+            somewhereNotZero = False
+            endingZero = False
 
             for k in range(beginningZeroK, len(self._binomial_cache[n])):
                 # _binomial_cache[n][k]
                 # is 'n choose k'
                 # and k = envPos
-                local_element_tree_pos["env"][k] = {"mass": None, "abun": 0}
                 if not endingZero:
                     try:
                         aPower = aPowerCache[n - k]
@@ -1295,10 +1669,8 @@ class IsotopologueLibrary(dict):
                             )
                         else:
                             bMassPower = bMassPowerCache[k] = 0
-                    local_element_tree_pos["env"][k]["abun"] = (
-                        aPower * bPower * self._binomial_cache[n][k]
-                    )
-                    local_element_tree_pos["env"][k]["mass"] = aMassPower + bMassPower
+                    abun = aPower * bPower * self._binomial_cache[n][k]
+                    env_mass[k - first_k] = aMassPower + bMassPower
                     # if element == '(15)N':
                     #     print('Stored mass and abundance for {0}, \
                     #    labeling percentile {1} and lvl {2}'.format( \
@@ -1307,20 +1679,23 @@ class IsotopologueLibrary(dict):
                     #
                     # Why are all trees build from start to the beginning ?
                     #
-                    if (
-                        local_element_tree_pos["env"][k]["abun"]
-                        <= self.params["ELEMENT_MIN_ABUNDANCE"]
-                    ):
-                        local_element_tree_pos["env"][k]["abun"] = int(0)
+                    if abun <= self.params["ELEMENT_MIN_ABUNDANCE"]:
                         if somewhereNotZero:
                             endingZero = True
                         else:
                             beginningZeroK = k + 1
                     else:
+                        env_abun[k - first_k] = abun
                         local_element_tree_pos["maxPos"] = k
                         if not somewhereNotZero:
                             somewhereNotZero = True
                             local_element_tree_pos["minPos"] = k
+            local_element_tree_pos["pos"] = np.arange(
+                first_k, len(self._binomial_cache[n]), dtype=np.int64
+            )
+            local_element_tree_pos["abun"] = env_abun
+            local_element_tree_pos["mass"] = env_mass
+            self.element_trees[element][label_percentile][n] = local_element_tree_pos
         return
 
     def _extend_isotopic_distributions_with_metabolic_labels(self):
@@ -1351,7 +1726,7 @@ class IsotopologueLibrary(dict):
                 if percentile <= sys.float_info.epsilon:
                     continue
                 pattern = self.regex["<isotope><element>"]
-                match = pattern.match(isotope_element)
+                match = _match_regex(pattern, isotope_element)
                 enriched_isotope = int(round(float(match.group("isotope"))))
                 template_element = match.group("element")
                 new_distribution = self._recalc_isotopic_distribution(
@@ -1359,9 +1734,7 @@ class IsotopologueLibrary(dict):
                     target_percentile=percentile,
                     enriched_isotope=enriched_isotope,
                 )
-                formated_pecentile = self.params["PERCENTILE_FORMAT_STRING"].format(
-                    percentile
-                )
+                formated_pecentile = self._format_percentile(percentile)
                 self.isotopic_distributions[template_element][
                     formated_pecentile
                 ] = new_distribution
@@ -1397,22 +1770,21 @@ class IsotopologueLibrary(dict):
             self.aa_compositions and self.isotopic_distributions
             are based on pyqms.knowledge_base and cached by `self._cache_kb`
         """
+        # most abundant natural isotope per element, looked up once
+        natural_isotopes = {}
         for labeled_aa, label_definitions in self.fixed_labels.items():
             for pos, uni_mod_string in enumerate(label_definitions):
                 new_aa = "{0}{1}".format(labeled_aa, pos)
                 try:
-                    new_aa_composition = copy.deepcopy(self.aa_compositions[labeled_aa])
-                except:
+                    # element counts are ints, a flat copy is sufficient
+                    new_aa_composition = dict(self.aa_compositions[labeled_aa])
+                except KeyError:
                     print("Error in _extend_kb_with_fixed_labels")
                     print(self.aa_compositions)
                     print(labeled_aa)
-                    # print( self.aa_compositions[ labeled_aa ] )
-                    # print( new_aa_composition = copy.deepcopy(
-                    #     self.aa_compositions[ labeled_aa ] )
-                    # )
                     exit(1)
-                formated_umod_list = self.regex["<isotope><element>(<count>)"].findall(
-                    uni_mod_string
+                formated_umod_list = _findall_regex(
+                    self.regex["<isotope><element>(<count>)"], uni_mod_string
                 )
                 for isotope, element, count in formated_umod_list:
                     if isotope == "":
@@ -1420,14 +1792,15 @@ class IsotopologueLibrary(dict):
                         # labeling is metabolically added,
                         # i.e. follows pulse chase if needed
                     else:
-                        isotope_sorted_by_abundance = sorted(
-                            self.isotopic_distributions[element][
-                                self.zero_labeled_percentile
-                            ],
-                            key=operator.itemgetter(1),
-                            reverse=True,
-                        )
-                        natural_isotope = isotope_sorted_by_abundance[0]
+                        try:
+                            natural_isotope = natural_isotopes[element]
+                        except KeyError:
+                            natural_isotope = natural_isotopes[element] = max(
+                                self.isotopic_distributions[element][
+                                    self.zero_labeled_percentile
+                                ],
+                                key=operator.itemgetter(1),
+                            )
                         natural_isoptop_trivial_name = str(
                             round(natural_isotope[0])
                         ).split(".")[0]
@@ -1441,7 +1814,6 @@ class IsotopologueLibrary(dict):
                         # print( self.metabolic_labels )
                         # print( str(mass_of_first_isotope).split('.')[0] )
                         # print( new_aa_composition )
-                        # print( isotope_sorted_by_abundance )
                         # formated_element = element
                         # if
                         else:
@@ -1470,7 +1842,9 @@ class IsotopologueLibrary(dict):
                                 formated_element
                             ] = percentile
 
-                    new_aa_composition[formated_element] += int(count)
+                    new_aa_composition[formated_element] = new_aa_composition.get(
+                        formated_element, 0
+                    ) + int(count)
                     if isotope != "":
                         enriched_isotope = isotope
                         template_element = element
@@ -1480,9 +1854,7 @@ class IsotopologueLibrary(dict):
                             target_percentile=percentile,
                             enriched_isotope=enriched_isotope,
                         )
-                        formated_pecentile = self.params[
-                            "PERCENTILE_FORMAT_STRING"
-                        ].format(percentile)
+                        formated_pecentile = self._format_percentile(percentile)
                         if formated_element not in self.isotopic_distributions.keys():
                             self.isotopic_distributions[formated_element] = {}
                         self.isotopic_distributions[formated_element][
@@ -1594,12 +1966,21 @@ class IsotopologueLibrary(dict):
             if len(label_combinations) == 0:
                 extended_set_of_molecules.add(molecule + addon)
             else:
-                label_combinations = self._create_combinations(
-                    sorted(label_combinations, reverse=True)
+                # combinations are generated lazily, one label index per
+                # labeled position
+                positions = sorted(label_combinations, reverse=True)
+                position_names = [name for name, _ in positions]
+                label_combinations = (
+                    list(zip(position_names, combo))
+                    for combo in itertools.product(
+                        *[range(n_labels) for _, n_labels in positions]
+                    )
                 )
                 for combination in label_combinations:
                     # print('Combo:',combination)
-                    modified_molecule = molecule
+                    # one list entry per aa, labeled aas are replaced in place
+                    # so that indices stay valid
+                    modified_molecule_parts = list(molecule)
                     states = set()
                     sorted_exchange_list = []
                     for element in combination:
@@ -1615,13 +1996,8 @@ class IsotopologueLibrary(dict):
                         aa,
                         fixed_label_index,
                     ) in sorted_exchange_list:
-                        modified_molecule = (
-                            "{seq1}{aa}{fixed_label_index}{seq2}".format(
-                                seq1=modified_molecule[:index_in_molecule],
-                                seq2=modified_molecule[index_in_molecule + 1 :],
-                                aa=aa,
-                                fixed_label_index=fixed_label_index,
-                            )
+                        modified_molecule_parts[index_in_molecule] = "{0}{1}".format(
+                            aa, fixed_label_index
                         )
                         if (
                             self.params["SILAC_AAS_LOCKED_IN_EXPERIMENT"] is not None
@@ -1631,17 +2007,15 @@ class IsotopologueLibrary(dict):
                         #     print(modified_molecule, 'aa', aa, 'in SILAC_LOCK')
                         # else:
                         #     print(modified_molecule, 'not added' )
+                    modified_molecule = "".join(modified_molecule_parts)
                     extend_variation_lookup = False
                     modified_molecule_incl_addon = modified_molecule + addon
                     if self.params["SILAC_AAS_LOCKED_IN_EXPERIMENT"] is not None:
                         if len(states) == 1:
                             all_states_in_molecule = set()
-                            state_pattern = re.compile(
-                                r"""(?P<AA>[A-Z]{1})(?P<state>[0-9]+)""", re.VERBOSE
-                            )
-                            for mol_state_aa, mol_state_pos in state_pattern.findall(
-                                modified_molecule
-                            ):
+                            for mol_state_aa, mol_state_pos in self.regex[
+                                "<aa><state>"
+                            ].findall(modified_molecule):
                                 if (
                                     mol_state_aa
                                     in self.params["SILAC_AAS_LOCKED_IN_EXPERIMENT"]
@@ -1656,17 +2030,9 @@ class IsotopologueLibrary(dict):
                         extended_set_of_molecules.add(modified_molecule_incl_addon)
                         extend_variation_lookup = True
                     if extend_variation_lookup:
-                        try:
-                            self.lookup["molecule fixed label variations"][
-                                full_molecule
-                            ]
-                        except:
-                            self.lookup["molecule fixed label variations"][
-                                full_molecule
-                            ] = set()
-                        self.lookup["molecule fixed label variations"][
-                            full_molecule
-                        ].add(modified_molecule_incl_addon)
+                        self.lookup["molecule fixed label variations"].setdefault(
+                            full_molecule, set()
+                        ).add(modified_molecule_incl_addon)
                     # print('>>>',
                     #     molecule,
                     #     modified_molecule,
@@ -1676,6 +2042,28 @@ class IsotopologueLibrary(dict):
                     # )
         return extended_set_of_molecules
 
+    def _format_percentile(self, percentile):
+        """
+        Formats a label percentile using params['PERCENTILE_FORMAT_STRING'].
+
+        The formated strings are used as keys throughout the library and are
+        cached (and interned) per percentile.
+
+        Args:
+            percentile (float): label percentile, e.g. 0.994
+
+        Returns:
+            str: formated percentile, e.g. '0.994'
+        """
+        try:
+            formated_percentile = self._formated_percentiles[percentile]
+        except KeyError:
+            formated_percentile = sys.intern(
+                self.params["PERCENTILE_FORMAT_STRING"].format(percentile)
+            )
+            self._formated_percentiles[percentile] = formated_percentile
+        return formated_percentile
+
     def _increase_element_envelope(self, element=None, label_percentile=None, count=0):
         """
         Calculates envelopes of an element that has more than two isotopes.
@@ -1686,104 +2074,29 @@ class IsotopologueLibrary(dict):
 
         Stores element tree in self.element_trees
         """
-        # print("Debug _increase_element_envelope with element/count", element, count)
         if count != 0:
             count -= 1
-            # for  label_percentile  in self.isotopic_distributions[ element ].keys():
             n = self.computed_level_complex_isotopes + 1
-            # import pprint
-            # pprint.pprint(self.element_trees[element])
-            # if  label_percentile  not in self.element_trees[element]:
-            #     self.element_trees[element][ label_percentile ] = {}
+            previous_env = self.element_trees[element][label_percentile][
+                self.computed_level_complex_isotopes
+            ]
+            isotopes = self.element_trees[element][label_percentile][1]
+            env_pos, env_abun, env_mass, minPos, maxPos = _convolve_element_envelope(
+                previous_env["pos"],
+                previous_env["abun"],
+                previous_env["mass"],
+                isotopes["pos"],
+                isotopes["abun"],
+                isotopes["mass"],
+                self.params["ELEMENT_MIN_ABUNDANCE"],
+            )
             self.element_trees[element][label_percentile][n] = {
-                "env": {},
-                "minPos": None,
-                "maxPos": None,
+                "pos": env_pos,
+                "abun": env_abun,
+                "mass": env_mass,
+                "minPos": minPos,
+                "maxPos": maxPos,
             }
-            # print('>>>',n)
-            # print('FIX THE BUG ....')
-            # print( self.element_trees[element][ label_percentile ] )
-            # print( "self.isotopic_distributions[element]", self.isotopic_distributions[element])
-            # print( "element", element )
-            # print( " self.element_trees[element] ", self.element_trees[element] )
-            for envPos in sorted(
-                self.element_trees[element][label_percentile][
-                    self.computed_level_complex_isotopes
-                ]["env"].keys()
-            ):
-                for (
-                    isotopeMass,
-                    isotopeAbundance,
-                    isotopePos,
-                ) in self.isotopic_distributions[element][label_percentile]:
-                    if (
-                        envPos + isotopePos
-                        not in self.element_trees[element][label_percentile][n][
-                            "env"
-                        ].keys()
-                    ):
-                        self.element_trees[element][label_percentile][n]["env"][
-                            envPos + isotopePos
-                        ] = {"mass": [], "abun": 0}
-
-                    # abundance
-                    previousAbundance = self.element_trees[element][label_percentile][
-                        self.computed_level_complex_isotopes
-                    ]["env"][envPos]["abun"]
-                    isotopeAbundance = self.isotopic_distributions[element][
-                        label_percentile
-                    ][isotopePos][1]
-                    self.element_trees[element][label_percentile][n]["env"][
-                        envPos + isotopePos
-                    ]["abun"] += (previousAbundance * isotopeAbundance)
-
-                    # mass
-                    previousMass = self.element_trees[element][label_percentile][
-                        self.computed_level_complex_isotopes
-                    ]["env"][envPos]["mass"]
-                    isotopeMass = self.isotopic_distributions[element][
-                        label_percentile
-                    ][isotopePos][0]
-                    self.element_trees[element][label_percentile][n]["env"][
-                        envPos + isotopePos
-                    ]["mass"].append(previousMass + isotopeMass)
-
-            minPos = False
-            for envPos in self.element_trees[element][label_percentile][n][
-                "env"
-            ].keys():  # calc mean mass
-                pathsMassSum = sum(
-                    self.element_trees[element][label_percentile][n]["env"][envPos][
-                        "mass"
-                    ]
-                )
-                pathsNumber = len(
-                    self.element_trees[element][label_percentile][n]["env"][envPos][
-                        "mass"
-                    ]
-                )
-                self.element_trees[element][label_percentile][n]["env"][envPos][
-                    "mass"
-                ] = float(pathsMassSum) / float(pathsNumber)
-                if not minPos:
-                    if (
-                        self.element_trees[element][label_percentile][n]["env"][envPos][
-                            "abun"
-                        ]
-                        > self.params["ELEMENT_MIN_ABUNDANCE"]
-                    ):
-                        # this will find lowest and highest env pos where abundance is > 0
-                        self.element_trees[element][label_percentile][n][
-                            "minPos"
-                        ] = envPos  #  the range between these positions is ignored
-                        minPos = True
-                if (
-                    self.element_trees[element][label_percentile][n]["env"][envPos][
-                        "abun"
-                    ]
-                    > self.params["ELEMENT_MIN_ABUNDANCE"]
-                ):
-                    self.element_trees[element][label_percentile][n]["maxPos"] = envPos
             self.computed_level_complex_isotopes += 1
             self._increase_element_envelope(
                 element=element, count=count, label_percentile=label_percentile
@@ -1828,54 +2141,81 @@ class IsotopologueLibrary(dict):
                 metabolic_labels=self.metabolic_labels,
                 params=self.params,
             )
+        # the spectrum is converted once, so that slicing and transformation
+        # of all match sets work on arrays
+        mz_i_list = np.asarray(mz_i_list, dtype=np.float64).reshape(-1, 2)
         lower_value = (self.match_set_mz_range[0], 0)
         upper_value = (self.match_set_mz_range[1], 0)
         borders = (lower_value, upper_value)
         sliced_spec = self._slice_list(mz_i_list, borders)
+        # params are bundled once per spectrum
+        param_bundle = ParamBundle.from_dict(self.params)
+        minimum_number_of_matched_peaks = (
+            param_bundle.MINIMUM_NUMBER_OF_MATCHED_ISOTOPOLOGUES
+        )
+        m_score_threshold = param_bundle.M_SCORE_THRESHOLD
+        mz_score_percentile = results.params["MZ_SCORE_PERCENTILE"]
+        # the spectrum is transformed once and shared by all match sets, each
+        # match set only looks at the spectrum tmzs within its own tmzs
+        spec_tmz_set, spec_tmz_lookup = self._transform_spectrum(sliced_spec)
+        all_spec_tmzs = _sorted_tmz_array(spec_tmz_set)
         for package_number in self.match_sets.keys():
-            mz_range = self.match_sets[package_number]["mz_range"]
-            spec_tmz_set, spec_tmz_lookup = self._transform_spectrum(
-                sliced_spec, mz_range=mz_range
-            )
+            match_set = self.match_sets[package_number]
+            match_set_tmzs = match_set["tmzs"]
+            if len(match_set_tmzs) == 0:
+                continue
             # print(self.match_sets[package_number]['tmzs'])
             # print(spec_tmz_set)
+            lower_index = np.searchsorted(all_spec_tmzs, match_set_tmzs[0], side="left")
+            upper_index = np.searchsorted(
+                all_spec_tmzs, match_set_tmzs[-1], side="right"
+            )
+            spec_tmzs = all_spec_tmzs[lower_index:upper_index]
             if (
-                len(spec_tmz_set & self.match_sets[package_number]["tmzs"])
-                >= self.params["MINIMUM_NUMBER_OF_MATCHED_ISOTOPOLOGUES"]
+                _count_common_tmzs(spec_tmzs, match_set_tmzs)
+                >= minimum_number_of_matched_peaks
             ):
-                for index in range(
-                    self.match_sets[package_number]["ids"][0],
-                    self.match_sets[package_number]["ids"][1],
-                ):
+                # every c_peak with at least one tmz in the spectrum will
+                # be a matched peak, the matched peaks of all isotopologues
+                # of the package are counted at once. Isotopologues that
+                # cannot reach the minimum number of matched peaks are not
+                # scored at all
+                tmz_ranges = match_set["tmz_ranges"]
+                matched_peak_counts = np.concatenate(
+                    (
+                        [0],
+                        np.cumsum(
+                            np.searchsorted(spec_tmzs, tmz_ranges[:, 1], side="right")
+                            > np.searchsorted(spec_tmzs, tmz_ranges[:, 0], side="left")
+                        ),
+                    )
+                )[match_set["range_offsets"]]
+                numbers_of_matched_peaks = np.diff(matched_peak_counts)
+                matchable_indices = np.flatnonzero(
+                    numbers_of_matched_peaks >= minimum_number_of_matched_peaks
+                )
+                for index in (matchable_indices + match_set["ids"][0]).tolist():
+                    (
+                        lower_mz,
+                        upper_mz,
+                        charge,
+                        label_percentile_tuple,
+                        formula,
+                    ) = self.formulas_sorted_by_mz[index]
                     # >>>
                     match_results = self.match_isotopologue(
                         index=index,
                         spec_tmz_set=spec_tmz_set,
                         spec_tmz_lookup=spec_tmz_lookup,
-                        mz_score_percentile=results.params["MZ_SCORE_PERCENTILE"],
+                        sorted_spec_tmzs=spec_tmzs,
+                        mz_score_percentile=mz_score_percentile,
+                        param_bundle=param_bundle,
                     )
                     if match_results is None:
                         continue
                     score, scaling_factor, matched_peaks = match_results
-                    if score < self.params["M_SCORE_THRESHOLD"]:
-                        continue
-                    number_of_matched_peaks = 0
-                    for mmz, mi, ri, cmz, ci in matched_peaks:
-                        if mmz is not None:
-                            number_of_matched_peaks += 1
-                    if (
-                        number_of_matched_peaks
-                        < self.params["MINIMUM_NUMBER_OF_MATCHED_ISOTOPOLOGUES"]
-                    ):
+                    if score < m_score_threshold:
                         continue
-
-                    (
-                        lower_mz,
-                        upper_mz,
-                        charge,
-                        label_percentile_tuple,
-                        formula,
-                    ) = self.formulas_sorted_by_mz[index]
                     key = (file_name, formula, charge, label_percentile_tuple)
                     value = (spec_id, spec_rt, score, scaling_factor, matched_peaks)
                     # print('added', score, matched_peaks )
@@ -1892,6 +2232,8 @@ class IsotopologueLibrary(dict):
         spec_tmz_lookup=None,
         mz_i_list=None,
         mz_score_percentile=None,
+        sorted_spec_tmzs=None,
+        param_bundle=None,
     ):
         """
         Matches a single isotopologue onto a *mz_i_list* or *spec_tmz_set*
@@ -1911,9 +2253,15 @@ class IsotopologueLibrary(dict):
             spec_tmz_set (set of ints): tmz value set used for matching.
                 Requires spec_tmz_lookup to get the actual mz which is required
                 for scoring.
+            sorted_spec_tmzs (np.ndarray): spec_tmz_set as sorted np.int64
+                array (optional), saves the sorting if multiple isotopologues
+                are matched against the same spectrum.
             mz_score_percentile (float): Weighting of mz used for scoring.
                 (1 - mz_score_percentile) is then intensity weighting.
                 Values 0 - 1.0.
+            param_bundle (`pyqms.params.ParamBundle`): self.params as bundle
+                (optional), saves bundling if multiple isotopologues are
+                matched.
 
         Note:
             Depending on the machine (some measure intensity better than others)
@@ -1933,17 +2281,21 @@ class IsotopologueLibrary(dict):
                   measured_mz, measured_i, rel_i, calculated_mz, calculated_i
 
         Multiple m/z values can occur in the range of the measured precision
-        of every peak of the isotopologue, thus all combinations are
-        considered and scored. Only the best scored match is returned for
-        each isotopologue.
+        of every peak of the isotopologue. By default all combinations are
+        considered and scored. If params['EXHAUSTIVE_COMBO_SEARCH'] is False,
+        the m/z value closest to the calculated m/z is taken for every peak.
+        Only the best scored match is returned for each isotopologue.
 
         """
+        if param_bundle is None:
+            param_bundle = ParamBundle.from_dict(self.params)
         if index is None:
             assert formula is not None, "require formula information for match"
             assert charge is not None, "require charge information for match"
             assert label_percentile is not None, "require tuple list"
-            lower_mz = self[formula]["env"][label_percentile][charge]["mz"][0]
-            upper_mz = self[formula]["env"][label_percentile][charge]["mz"][-1]
+            env = self[formula]["env"][label_percentile]
+            lower_mz = env[charge]["mz"][0]
+            upper_mz = env[charge]["mz"][-1]
             # really easier via the index :)
             # use function blabla (to be written) to scan
             # self.formulas_sorted_by_mz for your target(s)
@@ -1955,6 +2307,7 @@ class IsotopologueLibrary(dict):
                 label_percentile,
                 formula,
             ) = self.formulas_sorted_by_mz[index]
+            env = self[formula]["env"][label_percentile]
         if mz_i_list is not None:
             assert (
                 spec_tmz_set is None
@@ -1965,14 +2318,32 @@ class IsotopologueLibrary(dict):
                 spec_tmz_set, spec_tmz_lookup = self._transform_spectrum(
                     sliced_spec, mz_range=(lower_mz, upper_mz)
                 )
-        full_isotopologue_set = self[formula]["env"][label_percentile][charge]["atmzs"]
-        overlap = full_isotopologue_set & spec_tmz_set
-        n_c_peaks = self[formula]["env"][label_percentile]["n_c_peaks"]
+        if sorted_spec_tmzs is None:
+            sorted_spec_tmzs = _sorted_tmz_array(spec_tmz_set)
+        # the tmzs of the spectrum within the tmz range of each c_peak are
+        # sliced from the sorted spectrum tmzs, the ranges are sorted as well
+        # so that the overlap is counted without double counting
+        tmz_ranges = env[charge]["tmzs"]
+        lower_indices = np.searchsorted(sorted_spec_tmzs, tmz_ranges[:, 0], side="left")
+        upper_indices = np.searchsorted(
+            sorted_spec_tmzs, tmz_ranges[:, 1], side="right"
+        )
+        matched_tmzs = []
+        overlap = 0
+        highest_matched_index = 0
+        for lower_index, upper_index in zip(
+            lower_indices.tolist(), upper_indices.tolist()
+        ):
+            matched_tmzs.append(sorted_spec_tmzs[lower_index:upper_index].tolist())
+            if upper_index > max(lower_index, highest_matched_index):
+                overlap += upper_index - max(lower_index, highest_matched_index)
+                highest_matched_index = upper_index
+        n_c_peaks = env["n_c_peaks"]
         results = None
         match_it = True
-        if len(overlap) < self.params["MINIMUM_NUMBER_OF_MATCHED_ISOTOPOLOGUES"]:
+        if overlap < param_bundle.MINIMUM_NUMBER_OF_MATCHED_ISOTOPOLOGUES:
             match_it = False
-        if len(overlap) / n_c_peaks < self.params["REQUIRED_PERCENTILE_PEAK_OVERLAP"]:
+        if overlap / n_c_peaks < param_bundle.REQUIRED_PERCENTILE_PEAK_OVERLAP:
             match_it = False
         if match_it:
             # print('found {0} % matches'.format( len(overlap)/n_c_peaks))
@@ -1982,63 +2353,117 @@ class IsotopologueLibrary(dict):
             #
             # Therefore all possible combinations of those hits have to
             # be evaluate in order to maximize the fit
-            matched_mmz_on_isotope_pos = {}
-            # sorted_overlap = sorted(  overlap )
-            matched_peaks = {}
-
-            for n, isotope_pos in enumerate(
-                self[formula]["env"][label_percentile]["c_peak_pos"]
-            ):
-                if isotope_pos is None:
-                    continue
-                matched_peaks[n] = [
-                    None,
-                    None,
-                    self[formula]["env"][label_percentile]["relabun"][n],
-                    self[formula]["env"][label_percentile][charge]["mz"][n],
-                    self[formula]["env"][label_percentile]["abun"][n],
-                ]
-                tmz = self[formula]["env"][label_percentile][charge]["tmzs"][n]
-                matched_mmz_on_isotope_pos[n] = list(overlap & tmz)
+            # c_peaks are scored as arrays (see _score_peaks), all of them
+            # pass MIN_REL_PEAK_INTENSITY_FOR_MATCHING by definition.
+            # Measured mz and intensity of unmatched peaks stay NaN,
+            # position k in the arrays is the k-th c_peak.
+            c_peak_indices = env["c_peak_indices"]
+            ri = env["c_peak_relabun"]
+            cmz = env[charge]["c_peak_mz"]
+            ci = env["c_peak_abun"]
+            mmz = np.full(len(c_peak_indices), np.nan)
+            mi = np.full(len(c_peak_indices), np.nan)
+            inv_mz_range = env[charge]["c_peak_inv_mz_range"]
+            inv_i_range = env["c_peak_inv_i_range"]
 
             match_combinations = []
-            for n, match_list in sorted(matched_mmz_on_isotope_pos.items()):
+            for k, match_list in enumerate(matched_tmzs):
                 if len(match_list) > 0:
-                    match_combinations.append((n, len(match_list)))
+                    match_combinations.append((k, len(match_list)))
             # print('> Match combos:', match_combinations )
-            scores = []
-            for match_combo in self._create_combinations(match_combinations):
-                # print( match_combo )
-                for isotope_pos, match_index in match_combo:
-                    matched_tmz = matched_mmz_on_isotope_pos[isotope_pos][match_index]
-                    measured_mz = spec_tmz_lookup[matched_tmz][0][0]
-                    measured_i = spec_tmz_lookup[matched_tmz][0][1]
-                    matched_peaks[isotope_pos][0] = measured_mz
-                    matched_peaks[isotope_pos][1] = measured_i
-                # print( matched_peaks.values() , match_combo )
-                score, scaling_factor = self.score_matches(
-                    matched_peaks.values(), mz_score_percentile
+            if len(match_combinations) == 0:
+                match_combos = []
+            elif param_bundle.EXHAUSTIVE_COMBO_SEARCH:
+                # combinations are generated lazily, the match index of each
+                # matched peak k is zipped to k when the combination is scored
+                matched_peak_positions = [k for k, _ in match_combinations]
+                match_combos = (
+                    zip(matched_peak_positions, match_indices)
+                    for match_indices in itertools.product(
+                        *[
+                            range(number_of_matches)
+                            for _, number_of_matches in match_combinations
+                        ]
+                    )
                 )
-                scores.append(
-                    (
-                        score,
-                        scaling_factor,
-                        tuple(
-                            (mmz, mi, ri, cmz, ci)
-                            for mmz, mi, ri, cmz, ci in matched_peaks.values()
-                        ),
+            else:
+                # every peak takes the measured peak closest to its
+                # calculated mz, i.e. only one combination is scored
+                closest_combo = []
+                for k, number_of_matches in match_combinations:
+                    calculated_mz = cmz[k]
+                    closest_combo.append(
+                        (
+                            k,
+                            min(
+                                range(number_of_matches),
+                                key=lambda match_index: abs(
+                                    spec_tmz_lookup[matched_tmzs[k][match_index]][0][0]
+                                    - calculated_mz
+                                ),
+                            ),
+                        )
                     )
+                match_combos = [closest_combo]
+            # best scored combination, ties in score and scaling factor are
+            # resolved by comparing the matched peaks like a sort would do
+            best_match = None
+            for match_combo in match_combos:
+                # print( match_combo )
+                for k, match_index in match_combo:
+                    matched_tmz = matched_tmzs[k][match_index]
+                    mmz[k], mi[k] = spec_tmz_lookup[matched_tmz][0]
+                score, scaling_factor = _score_peaks(
+                    mmz,
+                    mi,
+                    ri,
+                    cmz,
+                    ci,
+                    inv_mz_range=inv_mz_range,
+                    inv_i_range=inv_i_range,
+                    mz_score_percentile=mz_score_percentile,
                 )
-            scores.sort(reverse=True)
-            try:
-                results = scores[0]
-            except:
-                results = None
+                if best_match is not None and (score, scaling_factor) < best_match[:2]:
+                    continue
+                match = (
+                    score,
+                    scaling_factor,
+                    self._format_matched_peaks(
+                        formula, label_percentile, charge, mmz, mi
+                    ),
+                )
+                if best_match is None or match > best_match:
+                    best_match = match
+            results = best_match
             # print( results )
-            # import pprint
-            # pprint.pprint([ (so, sc, mp) for so, sc, mp in  scores ])
         return results
 
+    def _format_matched_peaks(self, formula, label_percentile, charge, mmz, mi):
+        """
+        Internal function which converts the measured mz and intensity arrays
+        of a match into the matched peaks tuple reported by match_isotopologue.
+
+        Returns:
+            tuple: one tuple of measured_mz, measured_i, rel_i, calculated_mz,
+            calculated_i per c_peak, measured values are None for unmatched
+            peaks.
+        """
+        env = self[formula]["env"][label_percentile]
+        c_peak_indices = env["c_peak_indices"]
+        matched_peaks = []
+        for measured_mz, measured_i, is_matched, relabun, mz, abun in zip(
+            mmz.tolist(),
+            mi.tolist(),
+            (~np.isnan(mmz)).tolist(),
+            env["relabun"][c_peak_indices].tolist(),
+            env[charge]["mz"][c_peak_indices].tolist(),
+            env["abun"][c_peak_indices].tolist(),
+        ):
+            if not is_matched:
+                measured_mz, measured_i = None, None
+            matched_peaks.append((measured_mz, measured_i, relabun, mz, abun))
+        return tuple(matched_peaks)
+
     def print_overview(self, formula, charge=None):
         """
         Prints an overview of a given molecule or formula to the std.out
@@ -2079,7 +2504,8 @@ class IsotopologueLibrary(dict):
         tl = self.lookup["formula to trivial name"].get(formula, None)
         if tl is not None:
             print("> Trivial name{0} {1}".format("" if len(tl) == 1 else "s", tl))
-        for label_percentile in sorted(self[formula]["env"]):
+        envs = self[formula]["env"]
+        for label_percentile in sorted(envs):
             print("> Label percentile", label_percentile)
             print(
                 """> Isotope pattern                                                Abundance\n pos      Mass\t\t\tm/z [MH]{0:+1}               transformed    rel.""".format(
@@ -2087,15 +2513,18 @@ class IsotopologueLibrary(dict):
                 )
             )
             # max_intensity = max(self[ formula ]['env'][ label_percentile ]['abun'])
-            number_of_isotopic_peaks = len(
-                self[formula]["env"][label_percentile]["abun"]
-            )
-            for n in range(number_of_isotopic_peaks):
-                mass = self[formula]["env"][label_percentile]["mass"][n]
-                abun = self[formula]["env"][label_percentile]["abun"][n]
-                mzc1 = self[formula]["env"][label_percentile][charge]["mz"][n]
-                relabun = self[formula]["env"][label_percentile]["relabun"][n]
-                c_pos = self[formula]["env"][label_percentile]["c_peak_pos"][n]
+            env = envs[label_percentile]
+            for n, (mass, abun, mzc1, relabun, c_pos) in enumerate(
+                zip(
+                    env["mass"].tolist(),
+                    env["abun"].tolist(),
+                    env[charge]["mz"].tolist(),
+                    env["relabun"].tolist(),
+                    env["c_peak_pos"].tolist(),
+                )
+            ):
+                if c_pos < 0:
+                    c_pos = None
                 print(
                     "{0: >3}\t{1:16.10f}\t{2:16.10f}\t{3:10.0f}\t{4:12.11f}\t{5}".format(
                         n, mass, mzc1, abun, relabun, c_pos
@@ -2125,8 +2554,9 @@ class IsotopologueLibrary(dict):
                 e.g. 13 for '13C'
 
         Returns:
-            new_distribution (list): List containing tuples of mass, abundance
-                and peak position.
+            new_distribution (tuple): Tuple containing tuples of mass,
+                abundance and peak position. The tuple is shared with the
+                cache and must not be modified.
 
             * **mass** original mass of template element
             * **abundance** recalculated abundance
@@ -2134,35 +2564,11 @@ class IsotopologueLibrary(dict):
 
 
         """
-        # print('recalc', element, target_percentile, enriched_isotope )
-        new_distribution = []
-        # target_percentile -=
-
-        total_other_isotope_abundance = 0
-
-        for mass, abundance, pos in self.isotopic_distributions[element][
-            self.zero_labeled_percentile
-        ]:
-            if int(round(mass)) != int(enriched_isotope):
-                total_other_isotope_abundance += abundance
-                continue
-            natural_abundance = abundance
-
-        diff_in_abundance = natural_abundance - target_percentile
-        for mass, abundance, pos in self.isotopic_distributions[element][
-            self.zero_labeled_percentile
-        ]:
-
-            share_in_difference = (
-                abundance * diff_in_abundance / total_other_isotope_abundance
-            )
-
-            if int(round(mass)) == int(enriched_isotope):
-                abundance = target_percentile
-            else:
-                abundance += share_in_difference
-            new_distribution.append((mass, abundance, pos))
-        return new_distribution
+        return _enrich_isotopic_distribution(
+            tuple(self.isotopic_distributions[element][self.zero_labeled_percentile]),
+            target_percentile,
+            int(enriched_isotope),
+        )
 
     def score_matches(self, matched_peaks, mz_score_percentile):
         """
@@ -2435,85 +2841,41 @@ class IsotopologueLibrary(dict):
 
 
         """
-        # print('-'*40)
-        # if min_abundance is None:
-        #     min_abundance = self.params['MOLECULE_MIN_ABUNDANCE']
-        total_measured_i = 0
-        total_calculated_i = 0
-        ri_sum = 0
-        for mmz, mi, ri, cmz, ci in matched_peaks:
-            if ri < self.params["MIN_REL_PEAK_INTENSITY_FOR_MATCHING"]:
-                continue
-            if mmz is not None:
-                total_calculated_i += ci * ri
-                total_measured_i += mi * ri
-            ri_sum += ri  # math.log(1+ri,10)
-
-        scaling_factor = total_measured_i / float(total_calculated_i)
-        # NOTE: old_pyQms scaling is not weighted by rel_i
-        mz_score = 0
-        i_score = 0
-        mz_range = self.params["REL_MZ_RANGE"]
-        i_range = self.params["REL_I_RANGE"]
-        for mmz, mi, ri, cmz, ci in matched_peaks:
-            if ri < self.params["MIN_REL_PEAK_INTENSITY_FOR_MATCHING"]:
-                continue
-            if mmz is None:
-                continue
-            si = ci * scaling_factor
-            if cmz > sys.float_info.epsilon:
-                rel_mz_error = abs(mmz - cmz) / cmz
-                if rel_mz_error > mz_range:
-                    local_mz_score = 0
-                else:
-                    local_mz_score = 1 - (rel_mz_error / mz_range)
-                mz_score += local_mz_score * ri  # math.log(1+ri,10)#* ri
-
-            if si > sys.float_info.epsilon:
-                rel_i_error = abs(mi - si) / si
-                scaled_i_range = 1.0 + i_range - ri
-                if rel_i_error > scaled_i_range:
-                    local_i_score = 0
-                else:
-                    local_i_score = 1 - (rel_i_error / scaled_i_range)
-                i_score += local_i_score * ri  # math.log(1+ri,10) #* ri
-        #
-        mz_score = mz_score / ri_sum
-        mz_score_fraction = mz_score * mz_score_percentile
-        i_score = i_score / ri_sum
-        i_score_fraction = i_score * (1 - mz_score_percentile)
-        score = mz_score_fraction + i_score_fraction
-        # if score > 1:
-        #     print(matched_peaks,'WW')
-        #     print( scaling_factor )
-        #     print( i_score, mz_score)
-        #     print([ri for mmz,mi,ri,cmz,ci in matched_peaks])
-        #     print(sum([ri for mmz,mi,ri,cmz,ci in matched_peaks]))
-        #     print(tmp)
-        #     print(sum(tmp))
-        #     exit(1)
-        # print('score:\t{0}'.format(score))
-        # print('scaling:',scaling_factor)
-        # print()
-        return score, scaling_factor
+        # None (no measured peak) is converted to NaN
+        matched_peaks = np.array(list(matched_peaks), dtype=np.float64).reshape(-1, 5)
+        matched_peaks = matched_peaks[
+            matched_peaks[:, 2] >= self.params["MIN_REL_PEAK_INTENSITY_FOR_MATCHING"]
+        ]
+        mmz, mi, ri, cmz, ci = matched_peaks.T
+        return _score_peaks(
+            mmz,
+            mi,
+            ri,
+            cmz,
+            ci,
+            inv_mz_range=1.0 / (cmz * self.params["REL_MZ_RANGE"]),
+            inv_i_range=1.0 / (1.0 + self.params["REL_I_RANGE"] - ri),
+            mz_score_percentile=mz_score_percentile,
+        )
 
     def _slice_list(self, source_list, borders, tolerance=2):
         """
         Bisect a given list by using the minimum and maximum of a defined border
         (list or tuple of values)
         """
-        lower_value = list(borders[0])
-        upper_value = list(borders[1])
         is_numpy_array = getattr(source_list, "tolist", False)
         if is_numpy_array is False:
             # normal arrays ...
-            try:
-                min_pos = bisect.bisect(source_list, lower_value) - tolerance
-                max_pos = bisect.bisect(source_list, upper_value) + tolerance
-            except:
-                # the list has tuples instead of list
-                min_pos = bisect.bisect(source_list, tuple(lower_value)) - tolerance
-                max_pos = bisect.bisect(source_list, tuple(upper_value)) + tolerance
+            # borders are compared as the type of the list entries, since
+            # lists and tuples cannot be compared with each other
+            if len(source_list) > 0 and isinstance(source_list[0], tuple):
+                lower_value = tuple(borders[0])
+                upper_value = tuple(borders[1])
+            else:
+                lower_value = list(borders[0])
+                upper_value = list(borders[1])
+            min_pos = bisect.bisect(source_list, lower_value) - tolerance
+            max_pos = bisect.bisect(source_list, upper_value) + tolerance
 
             if min_pos < 0:
                 min_pos = 0
@@ -2522,12 +2884,13 @@ class IsotopologueLibrary(dict):
 
             r_list = source_list[min_pos:max_pos]
         else:
-            r_list = source_list[
-                np.where(
-                    (lower_value[0] - tolerance < source_list[:, 0])
-                    * (source_list[:, 0] < upper_value[0] + tolerance)
-                )
-            ]
+            # spectra are sorted by mz, i.e. the mz column can be bisected
+            mz_values = source_list[:, 0]
+            lower_mz = borders[0][0] - tolerance
+            upper_mz = borders[1][0] + tolerance
+            min_pos = np.searchsorted(mz_values, lower_mz, side="right")
+            max_pos = np.searchsorted(mz_values, upper_mz, side="left")
+            r_list = source_list[min_pos:max_pos]
         return r_list
 
     def _transform_mz_to_set(self, mz):
@@ -2542,14 +2905,40 @@ class IsotopologueLibrary(dict):
         (e.g. 1000 ) to use integers instead of floats. This results in a faster
         processing in the algorithm.
         """
+        tlower_mz, tupper_mz = self._transform_mz_to_range(mz)
+        tmp = set(range(tlower_mz, tupper_mz + 1))
+        return tmp
+
+    def _transform_mz_to_range(self, mz):
+        """
+        Internal function which returns the lowest and highest transformed mz
+        value of the set created by _transform_mz_to_set.
+
+        Returns:
+            tuple: lowest and highest transformed mz value (ints)
+        """
         mz_error = mz * self.params["REL_MZ_RANGE"]
         lower_mz = mz - mz_error
         tlower_mz = lower_mz * self.params["INTERNAL_PRECISION"]
         upper_mz = mz + mz_error
         tupper_mz = upper_mz * self.params["INTERNAL_PRECISION"]
+        return int(round(tlower_mz)), int(round(tupper_mz))
 
-        tmp = set(range(int(round(tlower_mz)), int(round(tupper_mz)) + 1))
-        return tmp
+    def _transform_mzs_to_ranges(self, mzs):
+        """
+        Internal function which transforms an array of mz values like
+        _transform_mz_to_range, reading the params only once.
+
+        Returns:
+            np.ndarray: lowest and highest transformed mz value per mz,
+            np.int64 array of shape (n, 2)
+        """
+        mz_errors = mzs * self.params["REL_MZ_RANGE"]
+        internal_precision = self.params["INTERNAL_PRECISION"]
+        tmz_ranges = np.empty((len(mzs), 2), dtype=np.int64)
+        tmz_ranges[:, 0] = np.rint((mzs - mz_errors) * internal_precision)
+        tmz_ranges[:, 1] = np.rint((mzs + mz_errors) * internal_precision)
+        return tmz_ranges
 
     def _transform_spectrum(self, mz_i_list, mz_range=None):
         """
@@ -2560,7 +2949,8 @@ class IsotopologueLibrary(dict):
         transformed by the INTERNAL_PRECISION (i.e. 1000) to use integers
         instead of floats.
         Additionally a lookup is returned which maps the transformed values to
-        the original m/z values including their intensities.
+        the original m/z values including their intensities. For spectra given
+        as np.ndarray the lookup is a read only mapping.
         """
         tmz_set = set()
         tmz_lookup = {}
@@ -2578,27 +2968,25 @@ class IsotopologueLibrary(dict):
 
         is_numpy_array = getattr(target_mz_list, "tolist", False)
         if is_numpy_array is False:
+            internal_precision = self.params["INTERNAL_PRECISION"]
             for mz, intensity in target_mz_list:
-                tmz = int(round(mz * self.params["INTERNAL_PRECISION"]))
-                tmz_set.add(tmz)
-                try:
-                    tmz_lookup[tmz].append((mz, intensity))
-                except:
-                    tmz_lookup[tmz] = [(mz, intensity)]
+                tmz = int(round(mz * internal_precision))
+                tmz_lookup.setdefault(tmz, []).append((mz, intensity))
+            tmz_set = set(tmz_lookup)
         else:
-            tmz = np.round(
-                target_mz_list[:, 0] * self.params["INTERNAL_PRECISION"]
-            ).astype(int)
-            for pos, tmz_entry in enumerate(tmz):
-                try:
-                    tmz_lookup[tmz_entry].append(
-                        (target_mz_list[pos][0], target_mz_list[pos][1])
-                    )
-                except:
-                    tmz_lookup[tmz_entry] = [
-                        (target_mz_list[pos][0], target_mz_list[pos][1])
-                    ]
-            tmz_set = set(tmz)
+            tmz = np.rint(target_mz_list[:, 0] * self.params["INTERNAL_PRECISION"])
+            tmz = tmz.astype(np.int64)
+            # peaks are grouped by tmz, the stable sort keeps the spectrum
+            # order within each group
+            order = np.argsort(tmz, kind="stable")
+            unique_tmzs, starts = np.unique(tmz[order], return_index=True)
+            tmz_lookup = _SpectrumTmzLookup(
+                unique_tmzs.tolist(),
+                starts.tolist() + [len(order)],
+                target_mz_list[order, 0].tolist(),
+                target_mz_list[order, 1].tolist(),
+            )
+            tmz_set = set(tmz_lookup)
 
         return tmz_set, tmz_lookup
 
@@ -24,9 +24,15 @@
 
 # """
 
-from collections import OrderedDict as odict
+import functools
+import hashlib
+import numbers
+import sys
+import types
+from collections import namedtuple
+import numpy as np
 
-params = {
+_params = {
     "PERCENTILE_FORMAT_STRING": "{0:.3f}",
     "M_SCORE_THRESHOLD": 0.5,
     "ELEMENT_MIN_ABUNDANCE": 1e-3,
@@ -53,11 +59,28 @@ params = {
     "MAX_MOLECULES_PER_MATCH_BIN": 20,
     "MZ_SCORE_PERCENTILE": 0.4,
     # Intensity Score complements
+    "EXHAUSTIVE_COMBO_SEARCH": True,
+    # ^-- score all combinations of measured peaks within the m/z error,
+    # if False only the measured peaks closest to the calculated m/z
     "SILAC_AAS_LOCKED_IN_EXPERIMENT": None,
     "BUILD_RESULT_INDEX": True,
+    "STREAM_MATCH_SETS": False,
+    # ^-- match sets are written to temporary files and loaded during
+    # matching, reduces RAM for very large libraries
     "MACHINE_OFFSET_IN_PPM": 0.0,
     # ^-- this will only be applied on calculated on mz values! not mass !
-    "FIXED_LABEL_ISOTOPE_ENRICHMENT_LEVELS": {"15N": 0.994, "13C": 0.996, "2H": 0.994},
+    "FIXED_LABEL_ISOTOPE_ENRICHMENT_LEVELS": types.MappingProxyType(
+        {
+            sys.intern(isotope): enrichment_level
+            for isotope, enrichment_level in {
+                "15N": 0.994,
+                "13C": 0.996,
+                "2H": 0.994,
+            }.items()
+        }
+    ),
+    # ^-- read only as well, libraries extend their own copy with
+    # enrichment levels that are not specified
     "COLORS": {
         0.0: (37, 37, 37),
         0.1: (99, 99, 99),
@@ -72,163 +95,329 @@ params = {
         1: (27, 137, 62),
     },
 }
+# read only view, IsotopologueLibrary works on a copy that can be updated
+params = types.MappingProxyType(_params)
 
-params_descriptions = odict(
-    [
-        (
-            "matching_and_scoring",
-            [
-                {
-                    # 'simple_name' : 'Required percentile peak overlap between matched isotpologues and calculated isotopologues above threshold',
-                    "description": """Defines the percentile how many theoretical
+# key: (type, lowest value, highest value) checked by validate_params
+_SCHEMA = {
+    "REL_MZ_RANGE": (numbers.Real, 0, 1e-3),
+    "REL_I_RANGE": (numbers.Real, 0, 1),
+    "M_SCORE_THRESHOLD": (numbers.Real, 0, 1),
+    "MZ_SCORE_PERCENTILE": (numbers.Real, 0, 1),
+    "REQUIRED_PERCENTILE_PEAK_OVERLAP": (numbers.Real, 0, 1),
+    "MIN_REL_PEAK_INTENSITY_FOR_MATCHING": (numbers.Real, 0, 1),
+    "ELEMENT_MIN_ABUNDANCE": (numbers.Real, 0, 1),
+    "MINIMUM_NUMBER_OF_MATCHED_ISOTOPOLOGUES": (numbers.Integral, 1, float("inf")),
+    "LOWER_MZ_LIMIT": (numbers.Real, 0, float("inf")),
+    "UPPER_MZ_LIMIT": (numbers.Real, 0, float("inf")),
+    "INTENSITY_TRANSFORMATION_FACTOR": (numbers.Real, 0, float("inf")),
+    "INTERNAL_PRECISION": (numbers.Integral, 1, float("inf")),
+    "MAX_MOLECULES_PER_MATCH_BIN": (numbers.Integral, 1, float("inf")),
+}
+
+
+def validate_params(params):
+    """
+    Checks type and range of the params in _SCHEMA once, so that matching
+    does not need to check them.
+
+    Args:
+        params (dict): params, see pyqms.params
+
+    Raises:
+        ValueError: if a value has the wrong type or is out of range
+    """
+    for key, (value_type, lowest, highest) in _SCHEMA.items():
+        value = params[key]
+        # numpy scalars are numbers too, bools are not
+        if (
+            isinstance(value, bool)
+            or not isinstance(value, value_type)
+            or not lowest <= value <= highest
+        ):
+            raise ValueError(
+                "{0} has to be a {1} between {2} and {3}, got {4!r}".format(
+                    key, value_type.__name__, lowest, highest, value
+                )
+            )
+
+
+validate_params(_params)
+PARAMS_VALIDATED = True
+
+
+def get_params_fingerprint(params):
+    """
+    Hashes the values of a params dict, e.g. to tell whether cached results
+    were obtained with the same params.
+
+    Args:
+        params (dict): params, see pyqms.params
+
+    Returns:
+        str: hex digest, equal for params with equal values
+    """
+    items = []
+    for key, value in sorted(params.items()):
+        # read only views hash like the dicts they are copied into
+        if isinstance(value, types.MappingProxyType):
+            value = dict(value)
+        items.append((key, value))
+    return hashlib.blake2b(repr(items).encode(), digest_size=8).hexdigest()
+
+
+# fingerprint of the default params
+PARAMS_FINGERPRINT = get_params_fingerprint(_params)
+
+
+class ParamBundle(
+    namedtuple(
+        "ParamBundle",
+        [
+            "M_SCORE_THRESHOLD",
+            "ELEMENT_MIN_ABUNDANCE",
+            "MIN_REL_PEAK_INTENSITY_FOR_MATCHING",
+            "REQUIRED_PERCENTILE_PEAK_OVERLAP",
+            "MINIMUM_NUMBER_OF_MATCHED_ISOTOPOLOGUES",
+            "INTENSITY_TRANSFORMATION_FACTOR",
+            "UPPER_MZ_LIMIT",
+            "LOWER_MZ_LIMIT",
+            "REL_MZ_RANGE",
+            "REL_I_RANGE",
+            "INTERNAL_PRECISION",
+            "MZ_SCORE_PERCENTILE",
+            "EXHAUSTIVE_COMBO_SEARCH",
+            "MACHINE_OFFSET_IN_PPM",
+        ],
+    )
+):
+    """
+    Immutable snapshot of the params read during matching, exposed as
+    attributes, e.g. bundle.REL_MZ_RANGE instead of params['REL_MZ_RANGE'].
+
+    A bundle does not follow later changes of the params it was created from,
+    i.e. it has to be created again via ParamBundle.from_dict.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, params):
+        """
+        Creates a bundle from a params dict, see pyqms.params
+        """
+        return cls(*[params[key] for key in cls._fields])
+
+    @property
+    def MACHINE_OFFSET_FACTOR(self):
+        """
+        MACHINE_OFFSET_IN_PPM as factor for calculated mz values
+        """
+        return 1.0 + self.MACHINE_OFFSET_IN_PPM * 1e-6
+
+
+@functools.lru_cache(maxsize=1)
+def get_params_descriptions():
+    """
+    Returns the descriptions of the params, grouped into sections.
+
+    The descriptions are only needed by the docs and GUIs, i.e. they are
+    built on the first call and not at import.
+
+    Returns:
+        dict: section name pointing to a list of dicts with the keys
+        description (single line), key and default
+    """
+    # the params read on every match come first in their section
+    params_descriptions = {
+        "matching_and_scoring": [
+            {
+                # 'simple_name' : 'Relative m/z range',
+                "description": """Defines the relative m/z error range or the
+measuring precision of the used mass spectrometer. Is equal to the precision of
+the used machine in parts per million (ppm)""",
+                "key": "REL_MZ_RANGE",
+            },
+            {
+                # 'simple_name' : 'Relative intensity range',
+                "description": """Defines the relative intensity error range.
+Represents the relative error to the most intense peak.""",
+                "key": "REL_I_RANGE",
+            },
+            {
+                # 'simple_name' : 'Required percentile peak overlap between matched isotpologues and calculated isotopologues above threshold',
+                "description": """Defines the percentile how many theoretical
 and measured peaks must overlap so that the match is considered further.
 E.g. 0.5 dictates, that 2 of 4 peaks must ovelap""",
-                    "default": params["REQUIRED_PERCENTILE_PEAK_OVERLAP"],
-                    "key": "REQUIRED_PERCENTILE_PEAK_OVERLAP",
-                },
-                {
-                    # 'simple_name' : 'Element minimum abundance',
-                    "description": """Defines the minimum abundance of an element
+                "key": "REQUIRED_PERCENTILE_PEAK_OVERLAP",
+            },
+            {
+                # 'simple_name' : 'Element minimum abundance',
+                "description": """Defines the minimum abundance of an element
 to be considered for the calculation of the isotopologue(s)""",
-                    "default": params["ELEMENT_MIN_ABUNDANCE"],
-                    "key": "ELEMENT_MIN_ABUNDANCE",
-                },
-                {
-                    # 'simple_name' : 'Min relative peak intensity required for matching',
-                    "description": """Defines the relative minimum peak intensity
+                "key": "ELEMENT_MIN_ABUNDANCE",
+            },
+            {
+                # 'simple_name' : 'Min relative peak intensity required for matching',
+                "description": """Defines the relative minimum peak intensity
 within an isotopologue to be considered for matching""",
-                    "default": params["MIN_REL_PEAK_INTENSITY_FOR_MATCHING"],
-                    "key": "MIN_REL_PEAK_INTENSITY_FOR_MATCHING",
-                },
-                {
-                    # 'simple_name' : 'Relative intensity range',
-                    "description": """Defines the relative intensity error range.
-Represents the relative error to the most intense peak.""",
-                    "default": params["REL_I_RANGE"],
-                    "key": "REL_I_RANGE",
-                },
-                {
-                    # 'simple_name' : 'Relative m/z range',
-                    "description": """Defines the relative m/z error range or the
-measuring precision of the used mass spectrometer. Is equal to the precision of
-the used machine in parts per million (ppm)""",
-                    "default": params["REL_MZ_RANGE"],
-                    "key": "REL_MZ_RANGE",
-                },
-                {
-                    # 'simple_name' : 'm/z score percentile',
-                    "description": """Defines the weighting between the m/z error
+                "key": "MIN_REL_PEAK_INTENSITY_FOR_MATCHING",
+            },
+            {
+                # 'simple_name' : 'm/z score percentile',
+                "description": """Defines the weighting between the m/z error
 and the intensity error for the total score. This weighting can be adjusted for
 different mass spectrometers, depending on whether m/z or intensity can be
 measured more accurately""",
-                    "default": params["MZ_SCORE_PERCENTILE"],
-                    "key": "MZ_SCORE_PERCENTILE",
-                },
-                {
-                    # 'simple_name': 'Minimum number of isotopolgue matches required',
-                    "description": """Number of isotopologue peaks that are required
+                "key": "MZ_SCORE_PERCENTILE",
+            },
+            {
+                # 'simple_name': 'Minimum number of isotopolgue matches required',
+                "description": """Number of isotopologue peaks that are required
 to yield a mScore. Very small molecules may yield only one isotope peak
 (monoisotopic peak) or the non-monoisotopic peaks have a very low abundance, so
 that they ware not considered for macthing""",
-                    "default": params["MINIMUM_NUMBER_OF_MATCHED_ISOTOPOLOGUES"],
-                    "key": "MINIMUM_NUMBER_OF_MATCHED_ISOTOPOLOGUES",
-                },
-            ],
-        ),
-        (
-            "measurement_and_reporting",
-            [
-                {
-                    # 'simple_name' : 'Upper m/z limit',
-                    "description": """Defines the maximum m/z value to be
+                "key": "MINIMUM_NUMBER_OF_MATCHED_ISOTOPOLOGUES",
+            },
+            {
+                # 'simple_name': 'Exhaustive combination search',
+                "description": """If multiple measured peaks fall into the m/z
+error of a calculated peak, all combinations of those peaks are scored and the
+best one is reported. If False, only the measured peaks closest to the
+calculated m/z values are scored, which is faster but can report lower scores
+and different scaling factors""",
+                "key": "EXHAUSTIVE_COMBO_SEARCH",
+            },
+        ],
+        "measurement_and_reporting": [
+            {
+                # 'simple_name' : 'mScore threshold',
+                "description": """The minimum mScore, which should be reported.
+Typically a mScore above 0.7 yields a FDR below 1%. Lower mScore thresholds
+can be used to check for machine errors or to optimize matching of pulse-chase
+samples""",
+                "key": "M_SCORE_THRESHOLD",
+            },
+            {
+                # 'simple_name' : 'Upper m/z limit',
+                "description": """Defines the maximum m/z value to be
 considered by pyQms. Can be adjusted for better performance of pyQms or to
 limit for the measuring range of the used mass spectrometer""",
-                    "default": params["UPPER_MZ_LIMIT"],
-                    "key": "UPPER_MZ_LIMIT",
-                },
-                {
-                    # 'simple_name' : 'Lower m/z limit',
-                    "description": """Defines the minimum m/z value to be
+                "key": "UPPER_MZ_LIMIT",
+            },
+            {
+                # 'simple_name' : 'Lower m/z limit',
+                "description": """Defines the minimum m/z value to be
 considered by pyQms. Can be adjusted for better performance of pyQms or to
 limit for the measuring range of the used mass spectrometer""",
-                    "default": params["LOWER_MZ_LIMIT"],
-                    "key": "LOWER_MZ_LIMIT",
-                },
-                {
-                    # 'simple_name' : 'Machine offset in ppm',
-                    "description": """A mass spectrometer measuring error (constant
+                "key": "LOWER_MZ_LIMIT",
+            },
+            {
+                # 'simple_name' : 'Machine offset in ppm',
+                "description": """A mass spectrometer measuring error (constant
 machine/calibration dependent mass or m/z offset) can be defined here in parts
 per million (ppm)""",
-                    "default": params["MACHINE_OFFSET_IN_PPM"],
-                    "key": "MACHINE_OFFSET_IN_PPM",
-                },
-                {
-                    # 'simple_name' : 'mScore threshold',
-                    "description": """The minimum mScore, which should be reported.
-Typically a mScore above 0.7 yields a FDR below 1%. Lower mScore thresholds
-can be used to check for machine errors or to optimize matching of pulse-chase
-samples""",
-                    "default": params["M_SCORE_THRESHOLD"],
-                    "key": "M_SCORE_THRESHOLD",
-                },
-                {
-                    # 'simple_name' : 'Silac amino acids locked in experiment',
-                    "description": """These aminoacids have always the defined
+                "key": "MACHINE_OFFSET_IN_PPM",
+            },
+            {
+                # 'simple_name' : 'Silac amino acids locked in experiment',
+                "description": """These aminoacids have always the defined
 fixed SILCA modification and their atoms are not considered when calculating a
 partially labeling percentile""",
-                    "default": params["SILAC_AAS_LOCKED_IN_EXPERIMENT"],
-                    "key": "SILAC_AAS_LOCKED_IN_EXPERIMENT",
-                },
-            ],
-        ),
-        (
-            "internal",
-            [
-                {
-                    # 'simple_name' : 'Percentile format string',
-                    "description": """Defines the standard format string when
+                "key": "SILAC_AAS_LOCKED_IN_EXPERIMENT",
+            },
+        ],
+        "internal": [
+            {
+                # 'simple_name' : 'Percentile format string',
+                "description": """Defines the standard format string when
 formatting labeling percentile float. Standard format considers three floating
 points""",
-                    "default": params["PERCENTILE_FORMAT_STRING"],
-                    "key": "PERCENTILE_FORMAT_STRING",
-                },
-                {
-                    # 'simple_name' : 'Internal precision',
-                    "description": """Defines the internal precision for float to
+                "key": "PERCENTILE_FORMAT_STRING",
+            },
+            {
+                # 'simple_name' : 'Internal precision',
+                "description": """Defines the internal precision for float to
 int conversion""",
-                    "default": params["INTERNAL_PRECISION"],
-                    "key": "INTERNAL_PRECISION",
-                },
-                {
-                    # 'simple_name' : 'Maximum molecules per match bin',
-                    "description": """Defines the number of molecules per match bin.
+                "key": "INTERNAL_PRECISION",
+            },
+            {
+                # 'simple_name' : 'Maximum molecules per match bin',
+                "description": """Defines the number of molecules per match bin.
 Influences the matching speed""",
-                    "default": params["MAX_MOLECULES_PER_MATCH_BIN"],
-                    "key": "MAX_MOLECULES_PER_MATCH_BIN",
-                },
-                {
-                    # 'simple_name' : 'm/z transformation factor',
-                    "description": """All m/z values are transformed by this factor
+                "key": "MAX_MOLECULES_PER_MATCH_BIN",
+            },
+            {
+                # 'simple_name' : 'm/z transformation factor',
+                "description": """All m/z values are transformed by this factor
 This value will be multiplied with m/z values before converted to integer. This
 means that values with a difference of 0.1 ppm @ 1000 m/z won't be
 distinguishable""",
-                    "default": params["MZ_TRANSFORMATION_FACTOR"],
-                    "key": "MZ_TRANSFORMATION_FACTOR",
-                },
-                {
-                    # 'simple_name' : 'Intensity transformation factor',
-                    "description": """All intensities are transformed with this
+                "key": "MZ_TRANSFORMATION_FACTOR",
+            },
+            {
+                # 'simple_name' : 'Intensity transformation factor',
+                "description": """All intensities are transformed with this
 factor""",
-                    "default": params["INTENSITY_TRANSFORMATION_FACTOR"],
-                    "key": "INTENSITY_TRANSFORMATION_FACTOR",
-                },
-                {
-                    # 'simple_name' : 'Build result index',
-                    "description": """The results are indexed for faster access""",
-                    "default": params["BUILD_RESULT_INDEX"],
-                    "key": "BUILD_RESULT_INDEX",
-                },
-            ],
-        ),
-    ]
-)
+                "key": "INTENSITY_TRANSFORMATION_FACTOR",
+            },
+            {
+                # 'simple_name' : 'Build result index',
+                "description": """The results are indexed for faster access""",
+                "key": "BUILD_RESULT_INDEX",
+            },
+            {
+                # 'simple_name' : 'Stream match sets',
+                "description": """Match sets are stored in temporary files and
+only loaded during matching. Reduces the RAM required for very large libraries
+at the cost of matching speed""",
+                "key": "STREAM_MATCH_SETS",
+            },
+        ],
+    }
+    # defaults are read from params once per key and the descriptions are
+    # collapsed into single lines
+    for entries in params_descriptions.values():
+        for entry in entries:
+            entry["default"] = _params[entry["key"]]
+            entry["description"] = sys.intern(" ".join(entry["description"].split()))
+    return params_descriptions
+
+
+@functools.lru_cache(maxsize=1)
+def get_param_index():
+    """
+    Returns:
+        dict: param key pointing to a tuple of its section and description
+        entry, see get_params_descriptions
+    """
+    return {
+        entry["key"]: (section, entry)
+        for section, entries in get_params_descriptions().items()
+        for entry in entries
+    }
+
+
+@functools.lru_cache(maxsize=1)
+def get_param_table():
+    """
+    Returns the descriptions of the params as one structured array, i.e.
+    a column like table['key'] can be read without iterating the entries.
+
+    Returns:
+        numpy.ndarray: record per param with the fields section, key,
+        default and description, in the order of get_params_descriptions
+    """
+    return np.array(
+        [
+            (section, entry["key"], entry["default"], entry["description"])
+            for section, entries in get_params_descriptions().items()
+            for entry in entries
+        ],
+        dtype=[
+            ("section", "U32"),
+            ("key", "U48"),
+            ("default", "O"),
+            ("description", "O"),
+        ],
+    )
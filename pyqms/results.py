@@ -23,16 +23,15 @@ from collections import namedtuple
 import math
 import re
 import os
-from operator import itemgetter
 import pyqms
-import bisect
 import sys
 import csv
 import codecs
 import pyqms.adaptors
 import pprint
-import copy
+import itertools
 from collections import defaultdict as ddict
+import numpy as np
 import pandas as pd
 
 # import numpy
@@ -60,6 +59,12 @@ combined = namedtuple(
 file_name, molecule, charge, label_percentile_tuple = key
 """
 
+# formulas and molecules formatted as R expressions in the plots
+_FORMULA_ELEMENT_RE = re.compile(r"(?P<element>[A-Z][a-z]*).(?P<count>[0-9]*).")
+_FORMULA_ISOTOPE_RE = re.compile(r'\((?P<isotop>[0-9]+)\)"(?P<element>[A-Z][a-z]*)"')
+_MOLECULE_NUMBER_RE = re.compile(r"[0-9]+")
+_MOLECULE_LETTERS_RE = re.compile(r"[a-zA-Z]+")
+
 default_amount_csv_fieldnames = [
     "file_name",
     "formula",
@@ -78,6 +83,261 @@ default_amount_csv_fieldnames = [
 ]
 
 
+class _MatchStore(object):
+    """
+    Matches of one result key, stored column wise.
+
+    Scores and scaling factors are stored in numpy arrays that double their
+    capacity when full, spec_ids and rts are kept in lists since they can
+    hold native ids or (rt, unit) tuples. The peaks of all matches are packed
+    into one float64 array with a row (mmz, mi, rel_i, cmz, ci) per peak,
+    not matched peaks have nan instead of None as mmz and mi.
+
+    Iterating or indexing the store yields match tuples with peaks as tuple
+    of tuples, i.e. it can be used like a list of matches. Peak values are
+    returned as floats, like match_isotopologue reports them, also if ints
+    were added.
+    """
+
+    def __init__(self, match_class=match, capacity=4):
+        capacity = max(capacity, 1)
+        self._match_class = match_class
+        self.n = 0
+        self.spec_id = []
+        self.rt = []
+        self.score = np.empty(capacity, dtype=np.float64)
+        self.scaling_factor = np.empty(capacity, dtype=np.float64)
+        # peaks of match i are peak_rows[peak_offsets[i] : peak_offsets[i + 1]]
+        self.peak_offsets = np.zeros(capacity + 1, dtype=np.int64)
+        self.peak_rows = np.empty((5 * capacity, 5), dtype=np.float64)
+        # (score, index) of the first best score, see max_score
+        self._max_score = None
+        # rts in minutes, see rt_minutes
+        self._rt_minutes = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # derived arrays are not pickled
+        state["_rt_minutes"] = None
+        return state
+
+    @classmethod
+    def from_matches(cls, matches, match_class=match):
+        """
+        Creates a store from a list of matches, e.g. from unpickled results
+        """
+        store = cls(match_class=match_class, capacity=len(matches))
+        for entry in matches:
+            store.append(entry)
+        return store
+
+    def append(self, entry):
+        """
+        Appends a match tuple (spec_id, rt, score, scaling_factor, peaks)
+        """
+        if self.n == len(self.score):
+            self._grow()
+        # None (not matched) becomes nan
+        peaks = np.array(entry.peaks, dtype=np.float64).reshape(-1, 5)
+        first_row = self.peak_offsets[self.n]
+        last_row = first_row + len(peaks)
+        if last_row > len(self.peak_rows):
+            self._grow_peak_rows(last_row)
+        self.peak_rows[first_row:last_row] = peaks
+        self.spec_id.append(entry.spec_id)
+        self.rt.append(entry.rt)
+        self.score[self.n] = entry.score
+        self.scaling_factor[self.n] = entry.scaling_factor
+        self.peak_offsets[self.n + 1] = last_row
+        self.n += 1
+        self._max_score = None
+        self._rt_minutes = None
+
+    def _grow(self):
+        """
+        Doubles the capacity of the match columns, i.e. appending a match
+        copies the columns only log2(n) times in total.
+        """
+        capacity = len(self.score)
+        for column in ["score", "scaling_factor"]:
+            grown = np.empty(2 * capacity, dtype=np.float64)
+            grown[:capacity] = getattr(self, column)
+            setattr(self, column, grown)
+        peak_offsets = np.empty(2 * capacity + 1, dtype=np.int64)
+        peak_offsets[: capacity + 1] = self.peak_offsets
+        self.peak_offsets = peak_offsets
+
+    def _grow_peak_rows(self, min_rows):
+        """
+        Doubles the capacity of the peak rows, at least to min_rows.
+        """
+        peak_rows = np.empty((max(2 * len(self.peak_rows), min_rows), 5))
+        peak_rows[: len(self.peak_rows)] = self.peak_rows
+        self.peak_rows = peak_rows
+
+    def max_score(self):
+        """
+        Finds the first best score with np.argmax, the result is kept until
+        the next match is appended.
+
+        Returns:
+            tuple: best score and its index, (-1, -1) if the store is empty
+        """
+        if self._max_score is None:
+            if self.n == 0:
+                return (-1, -1)
+            i = int(np.argmax(self.scores_view()))
+            self._max_score = (self.score[i].item(), i)
+        return self._max_score
+
+    def scores_view(self):
+        """
+        Returns:
+            numpy.ndarray: view on the scores of all matches
+        """
+        return self.score[: self.n]
+
+    def scaling_factors_view(self):
+        """
+        Returns:
+            numpy.ndarray: view on the scaling factors of all matches
+        """
+        return self.scaling_factor[: self.n]
+
+    def peak_offsets_view(self):
+        """
+        Returns:
+            numpy.ndarray: view on the peak offsets, n + 1 values
+        """
+        return self.peak_offsets[: self.n + 1]
+
+    def peak_rows_view(self):
+        """
+        Returns:
+            numpy.ndarray: view on the peaks of all matches, shape (peaks, 5)
+        """
+        return self.peak_rows[: self.peak_offsets[self.n]]
+
+    def rt_array(self):
+        """
+        Returns:
+            numpy.ndarray: rts of all matches as float64, requires rts to be
+            numbers, e.g. not (rt, unit) tuples
+        """
+        return np.array(self.rt, dtype=np.float64)
+
+    def peak_counts(self):
+        """
+        Counts the peaks of each match, matched peaks have a measured mz.
+
+        Returns:
+            tuple: numbers of peaks and numbers of matched peaks per match
+        """
+        peak_offsets = self.peak_offsets_view()
+        matched_before = np.concatenate(
+            ([0], np.cumsum(~np.isnan(self.peak_rows_view()[:, 0])))
+        )
+        return np.diff(peak_offsets), np.diff(matched_before[peak_offsets])
+
+    def rt_minutes(self):
+        """
+        Converts the rts to minutes, (rt, 'second') tuples are divided by 60
+        and the rts of other tuples are taken as is, as well as plain numbers.
+        The result is kept until the next match is appended.
+
+        Returns:
+            numpy.ndarray: rts of all matches in minutes
+        """
+        if self._rt_minutes is None:
+            rt_minutes = []
+            for rt in self.rt:
+                if type(rt) is tuple:
+                    if rt[1] == "second":
+                        rt = rt[0] / 60
+                    else:
+                        rt = rt[0]
+                rt_minutes.append(rt)
+            self._rt_minutes = np.array(rt_minutes, dtype=np.float64)
+        return self._rt_minutes
+
+    def take_peak_rows(self, indices):
+        """
+        Gathers the peaks of the matches at the given positions.
+
+        Args:
+            indices (numpy.ndarray): positions of the matches
+
+        Returns:
+            tuple: stacked peak rows and number of peaks per match
+        """
+        starts = self.peak_offsets[indices]
+        peak_counts = self.peak_offsets[indices + 1] - starts
+        rows = np.arange(peak_counts.sum()) + np.repeat(
+            starts - (np.cumsum(peak_counts) - peak_counts), peak_counts
+        )
+        return self.peak_rows[rows], peak_counts
+
+    def _peak_tuples(self, i):
+        peaks = []
+        for row in self.peak_rows[
+            self.peak_offsets[i] : self.peak_offsets[i + 1]
+        ].tolist():
+            if math.isnan(row[0]):
+                row[0] = row[1] = None
+            peaks.append(tuple(row))
+        return tuple(peaks)
+
+    def take(self, indices):
+        """
+        Gathers the matches at the given positions, each column is indexed
+        once for all positions.
+
+        Args:
+            indices (list of int): positions of the matches
+
+        Returns:
+            list: match tuples
+        """
+        return list(
+            map(
+                self._match_class,
+                [self.spec_id[i] for i in indices],
+                [self.rt[i] for i in indices],
+                self.score[indices].tolist(),
+                self.scaling_factor[indices].tolist(),
+                map(self._peak_tuples, indices),
+            )
+        )
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.n))]
+        if i < 0:
+            i += self.n
+        if not 0 <= i < self.n:
+            raise IndexError("match index out of range")
+        return self._match_class(
+            self.spec_id[i],
+            self.rt[i],
+            self.score[i].item(),
+            self.scaling_factor[i].item(),
+            self._peak_tuples(i),
+        )
+
+    def __iter__(self):
+        return map(
+            self._match_class,
+            self.spec_id,
+            self.rt,
+            self.scores_view().tolist(),
+            self.scaling_factors_view().tolist(),
+            map(self._peak_tuples, range(self.n)),
+        )
+
+
 class Results(dict):
     """
     pyQms results class.
@@ -96,13 +356,12 @@ class Results(dict):
             * charge
             * label_percentiles
 
-        value (named tuple)
+        value (dict)
 
-            * spec_id
-            * rt
-            * score
-            * scaling_factor
-            * peaks
+            * data: matches, stored column wise, iterating yields named
+              tuples with spec_id, rt, score, scaling_factor, peaks.
+              data.max_score() returns the best score and its index
+            * len_data
 
     """
 
@@ -134,13 +393,46 @@ class Results(dict):
             "charges": set(),
             "formulas": set(),
             "label_percentiles": set(),
+            # m_key field -> value -> list of m_keys, see _index_key
+            "keys by": {field: {} for field in m_key._fields},
+            "key positions": {},
         }
         self._match_class = match
         self._m_key_class = m_key
         self._combined_class = combined
         self._silac_pairs = None
+        # file_names, formulas and label_percentiles shared by the keys
+        self._interned_key_fields = {}
         return
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # results pickled before matches were stored column wise hold lists
+        for value in self.values():
+            if not isinstance(value["data"], _MatchStore):
+                value["data"] = _MatchStore.from_matches(
+                    value["data"], match_class=self._match_class
+                )
+            # the best score is found by the store
+            value.pop("max_score", None)
+            value.pop("max_score_index", None)
+        if "_interned_key_fields" not in state:
+            self._interned_key_fields = {}
+        if "key positions" not in self.index:
+            self.index["keys by"] = {field: {} for field in self._m_key_class._fields}
+            self.index["key positions"] = {}
+            for m_key in self.keys():
+                self._index_key(m_key)
+
+    def _index_key(self, m_key):
+        """
+        Adds a new key to the lookups of keys by file_name, formula, charge
+        and label_percentiles, used by _parse_and_filter.
+        """
+        self.index["key positions"][m_key] = len(self.index["key positions"])
+        for field, value in zip(m_key._fields, m_key):
+            self.index["keys by"][field].setdefault(value, []).append(m_key)
+
     def add(self, key, value):
         """Adds match to the result container.
 
@@ -170,36 +462,29 @@ class Results(dict):
 
         """
         m_key = self._m_key_class(*key)
-        try:
-            self[m_key]
-        except:
-            self[m_key] = {
-                "data": [],
-                "max_score": -1,
-                "max_score_index": -1,
+        key_results = self.get(m_key)
+        if key_results is None:
+            # equal field values of new keys are stored only once
+            interned = self._interned_key_fields
+            m_key = self._m_key_class(
+                interned.setdefault(m_key.file_name, m_key.file_name),
+                interned.setdefault(m_key.formula, m_key.formula),
+                m_key.charge,
+                interned.setdefault(m_key.label_percentiles, m_key.label_percentiles),
+            )
+            key_results = self[m_key] = {
+                "data": _MatchStore(match_class=self._match_class),
                 "len_data": 0,
             }
-        entry = self._match_class(*value)
-        if self[m_key]["max_score"] < entry.score:
-            self[m_key]["max_score"] = entry.score
-            self[m_key]["max_score_index"] = len(self[m_key]["data"])
-            # test for this ...
-        self[m_key]["len_data"] += 1
-        self[m_key]["data"].append(entry)
-        self.index["files"].add(m_key.file_name)
-        self.index["charges"].add(m_key.charge)
-        self.index["formulas"].add(m_key.formula)
-        self.index["label_percentiles"].add(m_key.label_percentiles)
-        if self.params is not None and self.params["BUILD_RESULT_INDEX"] is True:
-            # molecule -> m_key list
-            # file     -> m_key list (index list)
-            # try:
-            #     self.index[ m_key.formula ]
-            # except:
-            #     self.index[ m_key.formula ] = set()
-
-            # this should make max results obsolete
-            pass
+            # the index only changes with new keys
+            self.index["files"].add(m_key.file_name)
+            self.index["charges"].add(m_key.charge)
+            self.index["formulas"].add(m_key.formula)
+            self.index["label_percentiles"].add(m_key.label_percentiles)
+            if self.params is None or self.params["BUILD_RESULT_INDEX"] is True:
+                self._index_key(m_key)
+        key_results["len_data"] += 1
+        key_results["data"].append(self._match_class(*value))
         return m_key
 
     def _parse_and_filter(
@@ -214,7 +499,8 @@ class Results(dict):
 
         Generalized generator that filters the results and yields only those
         keys that match given criteria. If a parameter is equal `None` then
-        it is not used to filter the data.
+        it is not used to filter the data. Keys are looked up in self.index
+        (see BUILD_RESULT_INDEX) and yielded in the order they were added.
 
         Args:
             molecules (list of str, optional): considered molecules. Those will
@@ -235,6 +521,26 @@ class Results(dict):
         """
         if molecules is not None:
             formulas = self._translate_molecules_to_formulas(molecules, formulas)
+        selections = []
+        for field, values in [
+            ("file_name", file_names),
+            ("formula", formulas),
+            ("charge", charges),
+            ("label_percentiles", label_percentiles),
+        ]:
+            if values is not None:
+                keys_by_value = self.index["keys by"][field]
+                selection = set()
+                for value in values:
+                    selection.update(keys_by_value.get(value, []))
+                selections.append(selection)
+        # the lookups are incomplete if BUILD_RESULT_INDEX was not set
+        if len(selections) != 0 and len(self.index["key positions"]) == len(self):
+            yield from sorted(
+                set.intersection(*selections),
+                key=self.index["key positions"].__getitem__,
+            )
+            return
         for key in self.keys():
             # file_name, molecule, charge, label_percentile_tuple = key
             if file_names is not None and key[0] not in file_names:
@@ -301,10 +607,82 @@ class Results(dict):
             label_percentiles=label_percentiles,
             formulas=formulas,
         ):
-            for i, entry in enumerate(self[key]["data"]):
-                if score_threshold is not None and entry.score < score_threshold:
-                    continue
-                yield key, i, entry
+            data = self[key]["data"]
+            if score_threshold is None:
+                for i, entry in enumerate(data):
+                    yield key, i, entry
+            elif data.max_score()[0] >= score_threshold:
+                indices = np.flatnonzero(data.scores_view() >= score_threshold).tolist()
+                yield from zip(itertools.repeat(key), indices, data.take(indices))
+
+    def extract_results_batch(
+        self,
+        molecules=None,
+        charges=None,
+        file_names=None,
+        label_percentiles=None,
+        formulas=None,
+        score_threshold=None,
+    ):
+        """
+        Extract selected results at once.
+
+        Same selection as extract_results, but rt, score and scaling_factor
+        of all selected entries are returned as one structured array instead
+        of yielding the entries one by one. Requires rts to be numbers.
+
+        Args:
+            molecules (list of str, optional): considered molecules. Those will
+                be translated using self._translate_molecules_to_formulas()
+            charges (list of int, optional): considered charge
+                states.
+            file_names (list of str, optional): list of file names to be
+                considered.
+            label_percentiles (list of tuple, optional): list of label percentile tuples
+                to be considered.
+            formulas (list of str): list of chemical formulas
+            score_threshold (float, optional): minimum score of the entries
+
+        Returns:
+            keys, entries (tuple) : list of result class keys and
+                numpy.recarray with the fields key_idx (position in keys),
+                idx (index of entry), rt, score and scaling_factor
+
+        """
+        dtype = [
+            ("key_idx", np.int64),
+            ("idx", np.int64),
+            ("rt", np.float64),
+            ("score", np.float64),
+            ("scaling_factor", np.float64),
+        ]
+        keys = []
+        batches = [np.empty(0, dtype=dtype)]
+        for key in self._parse_and_filter(
+            molecules=molecules,
+            charges=charges,
+            file_names=file_names,
+            label_percentiles=label_percentiles,
+            formulas=formulas,
+        ):
+            data = self[key]["data"]
+            if score_threshold is None:
+                indices = np.arange(len(data))
+            elif data.max_score()[0] >= score_threshold:
+                indices = np.flatnonzero(data.scores_view() >= score_threshold)
+            else:
+                continue
+            if len(indices) == 0:
+                continue
+            batch = np.empty(len(indices), dtype=dtype)
+            batch["key_idx"] = len(keys)
+            batch["idx"] = indices
+            batch["rt"] = data.rt_array()[indices]
+            batch["score"] = data.scores_view()[indices]
+            batch["scaling_factor"] = data.scaling_factors_view()[indices]
+            keys.append(key)
+            batches.append(batch)
+        return keys, np.concatenate(batches).view(np.recarray)
 
     def format_all_results(
         self,
@@ -320,8 +698,8 @@ class Results(dict):
         Structure
 
             columns
-                * file_name
-                * formula
+                * file_name (categorical)
+                * formula (categorical)
                 * charge
                 * label_percentiles
                 * spec_id
@@ -331,31 +709,85 @@ class Results(dict):
                 * peaks
 
         """
-        results = []
-        for key in self.keys():
-            for ion_match in self[key]["data"]:
-                extended = self._combined_class(*key, *ion_match)
-                results.append(extended)
-
-        results_df = pd.DataFrame(results)
+        keys = list(self.keys())
+        stores = [self[key]["data"] for key in keys]
+        # position of the key of each match
+        key_pos = np.repeat(np.arange(len(keys)), [len(store) for store in stores])
+        columns = {}
+        for pos, field in enumerate(self._m_key_class._fields):
+            key_values = pd.Series([key[pos] for key in keys])
+            if field in ("file_name", "formula"):
+                # few file names and formulas repeated for all matches, the
+                # column holds only the codes
+                codes, categories = pd.factorize(key_values)
+                columns[field] = pd.Categorical.from_codes(
+                    codes[key_pos], categories=categories
+                )
+            else:
+                columns[field] = key_values.to_numpy()[key_pos]
+        columns["spec_id"] = [spec_id for store in stores for spec_id in store.spec_id]
+        columns["rt"] = [rt for store in stores for rt in store.rt]
+        columns["score"] = np.concatenate(
+            [store.scores_view() for store in stores] + [np.empty(0)]
+        )
+        columns["scaling_factor"] = np.concatenate(
+            [store.scaling_factors_view() for store in stores] + [np.empty(0)]
+        )
+        # peaks are streamed into the column, no intermediate list
+        columns["peaks"] = np.fromiter(
+            itertools.chain.from_iterable(
+                map(store._peak_tuples, range(len(store))) for store in stores
+            ),
+            dtype=object,
+            count=len(key_pos),
+        )
+        # the columns are not copied again into the DataFrame
+        results_df = pd.DataFrame(
+            columns, columns=self._combined_class._fields, copy=False
+        )
         return results_df
 
     def _translate_molecules_to_formulas(self, molecules, formulas):
-        """"""
-        if formulas is not None:
-            formulas = set(formulas)
-        else:
-            formulas = set()
-        for molecule in molecules:
-            try:
-                translation = self.lookup["molecule to formula"][molecule]
-                formulas.add(translation)
-            except:
-                pass
-                # print('Cannot find formula translation for {0}'.format(
-                #     molecule )
-                # )
-        return formulas
+        """
+        Translates molecules into formulas using
+        self.lookup["molecule to formula"], molecules without translation are
+        ignored.
+
+        Translations are cached per set of molecules and formulas, the cache is
+        reset if molecules were added to the lookup.
+
+        Args:
+            molecules (list of str): molecules to translate
+            formulas (list of str): formulas added to the translations
+
+        Returns:
+            set: formulas
+        """
+        molecule_to_formula = self.lookup.get("molecule to formula", {})
+        cache = getattr(self, "_translation_cache", None)
+        if (
+            cache is None
+            or cache[0] is not molecule_to_formula
+            or cache[1] != len(molecule_to_formula)
+        ):
+            cache = (molecule_to_formula, len(molecule_to_formula), {})
+            self._translation_cache = cache
+        cache_key = (
+            frozenset(molecules),
+            None if formulas is None else frozenset(formulas),
+        )
+        translated = cache[2].get(cache_key, None)
+        if translated is None:
+            translated = set()
+            if formulas is not None:
+                translated.update(formulas)
+            for molecule in cache_key[0]:
+                translation = molecule_to_formula.get(molecule, None)
+                if translation is not None:
+                    translated.add(translation)
+            translated = frozenset(translated)
+            cache[2][cache_key] = translated
+        return set(translated)
 
     def max_score(
         self,
@@ -383,14 +815,16 @@ class Results(dict):
 
         """
         max_score = [0, None, None, None]
-        for key, i, entry in self.extract_results(
+        for key in self._parse_and_filter(
             molecules=molecules,
             charges=charges,
             file_names=file_names,
             label_percentiles=label_percentiles,
             formulas=formulas,
         ):
-            if entry.score > max_score[0]:
+            key_max_score, i = self[key]["data"].max_score()
+            if key_max_score > max_score[0]:
+                entry = self[key]["data"][i]
                 max_score[0] = entry.score
                 max_score[1] = key
                 max_score[2] = i
@@ -471,25 +905,54 @@ class Results(dict):
             "time_dependent_mz_error": ddict(list),
             "time_dependent_intensity_error": ddict(list),
         }
-        for key, i, entry in self.extract_results(**kwargs):
-            rt = int(round(entry.rt))
-            for mmz, mi, rel_i, cmz, ci in sorted(
-                entry.peaks, key=itemgetter(2), reverse=True
-            )[:topX]:
-                if mmz is not None:
-                    si = ci * entry.scaling_factor
-                    rel_i_error = abs(mi - si) / si
-                    if rel_i_error > 1:
-                        rel_i_error = 1
-                    rel_mz_error = (mmz - cmz) / cmz
-                    rel_mz_error_in_ppm = rel_mz_error * 1e6
-
-                    error_dict["mz_error"].append(rel_mz_error_in_ppm)
-                    error_dict["intensity_error"].append(rel_i_error)
-                    error_dict["time_dependent_mz_error"][rt].append(
-                        rel_mz_error_in_ppm
-                    )
-                    error_dict["time_dependent_intensity_error"][rt].append(rel_i_error)
+        keys, entries = self.extract_results_batch(**kwargs)
+        # entries are grouped by key
+        key_bounds = np.searchsorted(entries.key_idx, np.arange(len(keys) + 1))
+        peaks = [np.empty((0, 5))]
+        peak_counts = [np.empty(0, dtype=np.int64)]
+        for key_idx, key in enumerate(keys):
+            key_peaks, key_peak_counts = self[key]["data"].take_peak_rows(
+                entries.idx[key_bounds[key_idx] : key_bounds[key_idx + 1]]
+            )
+            peaks.append(key_peaks)
+            peak_counts.append(key_peak_counts)
+        # columns mmz, mi, rel_i, cmz, ci, nan if not matched
+        peaks = np.concatenate(peaks)
+        peak_counts = np.concatenate(peak_counts)
+        scaling_factors = entries.scaling_factor
+        rts = np.rint(entries.rt).astype(np.int64)
+        if len(peaks) != 0:
+            entry_pos = np.repeat(np.arange(len(peak_counts)), peak_counts)
+            first_peak_pos = np.cumsum(peak_counts) - peak_counts
+            # rel_i of the peaks of an entry per row, padded with -inf, so that
+            # only the short rows are sorted instead of all peaks
+            peak_pos_in_entry = np.arange(len(peaks)) - first_peak_pos[entry_pos]
+            rel_i_rows = np.full((len(peak_counts), peak_counts.max()), -np.inf)
+            rel_i_rows[entry_pos, peak_pos_in_entry] = peaks[:, 2]
+            # topX peaks with the highest rel_i per entry, ties in peak order
+            top_pos = np.argsort(-rel_i_rows, axis=1, kind="stable")[:, :topX]
+            order = (first_peak_pos[:, None] + top_pos)[top_pos < peak_counts[:, None]]
+            order = order[~np.isnan(peaks[order, 0])]
+            mmz, mi, rel_i, cmz, ci = peaks[order].T
+            si = ci * scaling_factors[entry_pos[order]]
+            rel_i_errors = np.minimum(np.abs(mi - si) / si, 1)
+            rel_mz_errors_in_ppm = (mmz - cmz) / cmz * 1e6
+
+            error_dict["mz_error"] = rel_mz_errors_in_ppm.tolist()
+            error_dict["intensity_error"] = rel_i_errors.tolist()
+            # errors grouped by rt bin, in peak order within a bin
+            rt_bins, rt_bin_of_peak = np.unique(
+                rts[entry_pos[order]], return_inverse=True
+            )
+            by_rt_bin = np.argsort(rt_bin_of_peak, kind="stable")
+            rt_bin_bounds = np.cumsum(np.bincount(rt_bin_of_peak))[:-1]
+            for rt, rt_mz_errors, rt_i_errors in zip(
+                rt_bins.tolist(),
+                np.split(rel_mz_errors_in_ppm[by_rt_bin], rt_bin_bounds),
+                np.split(rel_i_errors[by_rt_bin], rt_bin_bounds),
+            ):
+                error_dict["time_dependent_mz_error"][rt] = rt_mz_errors.tolist()
+                error_dict["time_dependent_intensity_error"][rt] = rt_i_errors.tolist()
         if plot and len(error_dict["mz_error"]) > 0:
             assert self._import_rpy2() == True, "require R & rpy2 installed..."
             grdevices.pdf(filename)
@@ -602,20 +1065,12 @@ class Results(dict):
     def _format_chemical_formula_for_r(self, key):
         formula = key.formula
         # print(formula)
-        formated_formula = re.sub(
-            r"(?P<element>[A-Z]{1}[a-z]*).(?P<count>[0-9]*).",
-            lambda match: '"{0}" ["{1}"], '.format(
-                match.group("element"), match.group("count")
-            ),
-            formula,
+        formated_formula = _FORMULA_ELEMENT_RE.sub(
+            r'"\g<element>" ["\g<count>"], ', formula
         )
         # print(formated_formula)
-        formated_formula = re.sub(
-            r'\((?P<isotop>[0-9]+)\)"(?P<element>[A-Z]{1}[a-z]*)"',
-            lambda match: '""^"{0}","{1}" '.format(
-                match.group("isotop"), match.group("element")
-            ),
-            formated_formula,
+        formated_formula = _FORMULA_ISOTOPE_RE.sub(
+            r'""^"\g<isotop>","\g<element>" ', formated_formula
         )
 
         r_expression = r("expression(paste({0}))".format(formated_formula))
@@ -624,8 +1079,8 @@ class Results(dict):
     def _format_molecule_for_r(self, key):
         # molecule = '/'.join( self.lookup['formula to molecule'][key.formula] )
         molecule = self.lookup["formula to molecule"][key.formula][0]
-        molecule = re.sub(r"[0-9]+", lambda x: '["' + x.group() + '"], ', molecule)
-        molecule = re.sub(r"[a-zA-Z]+", lambda x: '"' + x.group() + '" ', molecule)
+        molecule = _MOLECULE_NUMBER_RE.sub(r'["\g<0>"], ', molecule)
+        molecule = _MOLECULE_LETTERS_RE.sub(r'"\g<0>" ', molecule)
         molecule = '{0},""^"+{1}"'.format(molecule, key.charge)
         r_expression = r("expression(paste({0}))".format(molecule))
         return r_expression
@@ -645,51 +1100,66 @@ class Results(dict):
         data = {}
         all_specIDs = set()
         all_mz_values = set()
-        for entry in self[key]["data"]:
-            if rt_window is None or rt_window[0] <= entry.rt <= rt_window[1]:
-                all_specIDs.add(int(entry.spec_id))
-                for mmz, mi, ri, cmz, ci in entry.peaks:
-                    if mmz is None:
-                        intensity = 0
-                    else:
-                        intensity = ci * entry.scaling_factor
-                    data[int(entry.spec_id), cmz] = (intensity, entry.score)
-                    all_mz_values.add(cmz)
+        spec_scores = {}
+        matches = self[key]["data"]
+        peak_offsets = matches.peak_offsets_view()
+        for i, (spec_id, rt, score, scaling_factor) in enumerate(
+            zip(
+                matches.spec_id,
+                matches.rt,
+                matches.scores_view().tolist(),
+                matches.scaling_factors_view().tolist(),
+            )
+        ):
+            if rt_window is None or rt_window[0] <= rt <= rt_window[1]:
+                all_specIDs.add(int(spec_id))
+                mmz, mi, ri, cmz, ci = matches.peak_rows_view()[
+                    peak_offsets[i] : peak_offsets[i + 1]
+                ].T
+                # not matched peaks have no intensity
+                intensities = np.where(np.isnan(mmz), 0, ci * scaling_factor)
+                for mz, intensity in zip(cmz.tolist(), intensities.tolist()):
+                    data[int(spec_id), mz] = (intensity, score)
+                    all_mz_values.add(mz)
+                spec_scores[int(spec_id)] = score
 
         if len(all_mz_values) == 0:
             print("No matches found within window for key", key)
         else:
             min_mz = min(all_mz_values)
             max_mz = max(all_mz_values)
-            for specID, mz in list(data.keys()):
-                data[specID, min_mz - 0.1] = (0, data[specID, min_mz][1])
-                data[specID, max_mz + 0.1] = (0, data[specID, max_mz][1])
-                all_mz_values |= set([min_mz - 0.1, max_mz + 0.1])
-                for var in [-0.2, +0.2]:
-                    all_mz_values.add(mz + var)
-                    data[specID, mz + var] = (0, data[specID, mz][1])
+            # zero intensities 0.2 around each peak and 0.1 beyond the mz
+            # range, colored by the score of the spectrum
+            padding = {}
+            for specID, mz in data:
+                score = spec_scores[specID]
+                padding[specID, mz - 0.2] = (0, score)
+                padding[specID, mz + 0.2] = (0, score)
+            for specID, score in spec_scores.items():
+                padding[specID, min_mz - 0.1] = (0, score)
+                padding[specID, max_mz + 0.1] = (0, score)
+            data.update(padding)
+            padded_mz_values = set([min_mz - 0.1, max_mz + 0.1])
+            for var in [-0.2, +0.2]:
+                padded_mz_values |= set(mz + var for mz in all_mz_values)
+            all_mz_values |= padded_mz_values
             x_values = sorted(all_specIDs)
             y_values = sorted(all_mz_values)
-            z_values = []
-            c_values = []
             if len(x_values) <= 3:
                 print("Less than 3 x_values for key", key)
             else:
-                colors = []
-                for n in range(0, 101, 1):
-                    rgb_col, hex_col = self.colorize_score(n / 100)
-                    colors.append(hex_col)
-                for y in y_values:  # mz
-                    for x in x_values:  # specid
-                        if (x, y) not in data.keys():
-                            z = 0.0
-                            c = colors[0]
-                        else:
-                            z = i_trans_function(data[(x, y)][0])
-                            c = colors[int(round(data[(x, y)][1] * 100))]
-                        if y != y_values[-1] and x != x_values[-1]:
-                            c_values.append(c)
-                        z_values.append(z)
+                rgb_colors, colors = self._color_lut()
+                x_pos = {x: n for n, x in enumerate(x_values)}  # specid
+                y_pos = {y: n for n, y in enumerate(y_values)}  # mz
+                # rows are mz, columns specid, cells without data stay 0
+                z_grid = np.zeros((len(y_values), len(x_values)))
+                color_grid = np.zeros((len(y_values), len(x_values)), dtype=int)
+                for (x, y), (intensity, score) in data.items():
+                    z_grid[y_pos[y], x_pos[x]] = i_trans_function(intensity)
+                    color_grid[y_pos[y], x_pos[x]] = int(round(score * 100))
+                z_values = z_grid.ravel().tolist()
+                # facets are colored, i.e. the last mz and specid are left out
+                c_values = [colors[c] for c in color_grid[:-1, :-1].ravel().tolist()]
                 COLORS = {
                     "1_black": {"bg": "black", "fg": "white"},
                     "2_white": {"bg": "white", "fg": "black"},
@@ -710,6 +1180,19 @@ class Results(dict):
                     formated_molecule = " ".join(
                         self.lookup["formula to molecule"][key.formula]
                     )
+                # converted to R once for the plots of all color schemes
+                x_vector = robjects.FloatVector(x_values)
+                y_vector = robjects.FloatVector(y_values)
+                z_matrix = r.matrix(
+                    robjects.FloatVector(z_values), nrow=len(x_values), byrow=False
+                )
+                c_vector = robjects.StrVector(c_values)
+                legend_labels = r.c(
+                    ["{0:2.1f}".format(i / 100.0) for i in range(0, 101, 10)]
+                )
+                legend_colors = robjects.StrVector(
+                    [colors[i] for i in range(0, 101, 10)]
+                )
                 for plottingType in sorted(COLORS.keys()):
                     # grdevices.png('test_MIC.png' , width = 1600, height = 1600)
                     bg = COLORS[plottingType]["bg"]
@@ -729,13 +1212,9 @@ class Results(dict):
                         }
                     )
                     graphics.persp(
-                        robjects.FloatVector(x_values),
-                        robjects.FloatVector(y_values),
-                        r.matrix(
-                            robjects.FloatVector(z_values),
-                            nrow=len(x_values),
-                            byrow=False,
-                        ),
+                        x_vector,
+                        y_vector,
+                        z_matrix,
                         main=formated_molecule,
                         sub=formated_formula,
                         xlab="\n\nspectrum id",
@@ -752,15 +1231,13 @@ class Results(dict):
                         ltheta=-120,
                         lphi=40,
                         # ylim     = robjects.FloatVector([614,624]),
-                        col=robjects.StrVector(c_values),
+                        col=c_vector,
                     )
                     graphics.legend(
                         "topright",
                         title="mScore",
-                        legend=r.c(
-                            ["{0:2.1f}".format(i / 100.0) for i in range(0, 101, 10)]
-                        ),
-                        fill=robjects.StrVector([colors[i] for i in range(0, 101, 10)]),
+                        legend=legend_labels,
+                        fill=legend_colors,
                         bty="n",
                         xpd=True,
                         cex=0.7,
@@ -768,41 +1245,59 @@ class Results(dict):
                 grdevices.dev_off()
         return
 
+    def _color_lut(self):
+        """
+        Interpolates the colors of the scores 0, 0.01, ..., 1 between the
+        colors defined in params['COLORS'].
+
+        The colors are interpolated on the first call and again only if
+        params['COLORS'] changed.
+
+        Returns:
+            tuple: list of 101 rgb tuples and list of 101 hex color strings
+        """
+        color_lut = getattr(self, "_color_lut_cache", None)
+        if color_lut is None or color_lut[0] != self.params["COLORS"]:
+            score_thresholds = sorted(self.params["COLORS"].keys())
+            rgb_array = np.array(
+                [self.params["COLORS"][t] for t in score_thresholds], dtype=np.float64
+            )
+            # interpolate between the thresholds around each score, scores
+            # outside the thresholds get the outer colors (dX clipped to 0 or 1)
+            scores = np.arange(101) / 100
+            thresholds = np.array(score_thresholds, dtype=np.float64)
+            upper = np.clip(np.searchsorted(thresholds, scores), 1, len(thresholds) - 1)
+            lower = upper - 1
+            spans = thresholds[upper] - thresholds[lower]
+            dX = np.divide(
+                scores - thresholds[lower],
+                spans,
+                out=np.zeros_like(scores),
+                where=spans > 0,
+            )
+            dX = np.clip(dX, 0, 1)[:, None]
+            rgb_values = np.rint(
+                rgb_array[lower] + dX * (rgb_array[upper] - rgb_array[lower])
+            )
+            rgb_tuples = [tuple(rgb) for rgb in rgb_values.astype(int).tolist()]
+            hex_colors = ["#{0:02x}{1:02x}{2:02x}".format(*rgb) for rgb in rgb_tuples]
+            color_lut = (dict(self.params["COLORS"]), rgb_tuples, hex_colors)
+            self._color_lut_cache = color_lut
+        return color_lut[1], color_lut[2]
+
     def colorize_score(self, score):
-        """"""
-        ##
-        color = [0, 0, 0]  # copy becauuuuse  ?
-        colorGradient = [
-            (score_threshold, rgb_tuple)
-            for (score_threshold, rgb_tuple) in sorted(self.params["COLORS"].items())
-        ]
-        if score is not None:
-            idx = bisect.bisect(colorGradient, (score,))
-            if idx == 0:
-                color = colorGradient[0][1]
-            elif idx == len(colorGradient):
-                color = colorGradient[-1][1]
-            else:
-                # linear interpolation ... between idx-1 & idx
-                dX = (score - colorGradient[idx - 1][0]) / (
-                    colorGradient[idx][0] - colorGradient[idx - 1][0]
-                )
-                for color_chanel in range(3):
-                    d_ = dX * (
-                        colorGradient[idx][1][color_chanel]
-                        - colorGradient[idx - 1][1][color_chanel]
-                    )
-                    if abs(d_) <= sys.float_info.epsilon:
-                        color[color_chanel] = int(
-                            round(colorGradient[idx - 1][1][color_chanel])
-                        )
-                    else:
-                        color[color_chanel] = int(
-                            round(colorGradient[idx - 1][1][color_chanel] + d_)
-                        )
-        hexed_color = "#" + "".join([hex(c)[2:] for c in color])
+        """
+        Looks up the color of a score, rounded to two decimals, in the colors
+        interpolated between params['COLORS'], see _color_lut.
 
-        return color, hexed_color
+        Returns:
+            tuple: rgb color and hex color string, black if score is None
+        """
+        if score is None:
+            return (0, 0, 0), "#000000"
+        rgb_tuples, hex_colors = self._color_lut()
+        idx = min(max(int(round(score * 100)), 0), 100)
+        return rgb_tuples[idx], hex_colors[idx]
 
     def plot_MIC_2D(self, key, kwargs):
         """"""
@@ -850,24 +1345,23 @@ class Results(dict):
             # mar = r.c( 2, 2, 1, 2 ),
             # oma = r.c( 2, 2, 2, 2 )
         )
-        colors = []
-        for n in range(0, 101, 1):
-            rgb_col, hex_col = self.colorize_score(n / 100)
-            colors.append(hex_col)
+        rgb_colors, colors = self._color_lut()
+        colors_array = np.array(colors, dtype=object)
         # colors = self._generate_r_colors( 'rainbow', zlimits_color_ints[-1]-zlimits_color_ints[0]+1)
         for n, key in enumerate(key_list):
             if key not in self.keys():
                 print("Warning, do not have match results for {0}".format(key))
                 continue
-            x = []
-            y = []
-            s = []
-            c = []
-            for entry in self[key]["data"]:
-                if rt_window is None or rt_window[0] <= entry.rt <= rt_window[1]:
-                    x.append(entry.rt)
-                    y.append(entry.scaling_factor)
-                    s.append(entry.score)
+            data = self[key]["data"]
+            rts = data.rt_array()
+            if rt_window is None:
+                in_window = np.ones(len(rts), dtype=bool)
+            else:
+                in_window = (rt_window[0] <= rts) & (rts <= rt_window[1])
+            x = rts[in_window].tolist()
+            y = data.scaling_factors_view()[in_window].tolist()
+            scores = data.scores_view()[in_window]
+            s = scores.tolist()
             assert (
                 min(s) >= zlimits[0]
             ), "zlimits are set wrong, plots wont be conform, min score was {0}".format(
@@ -880,11 +1374,9 @@ class Results(dict):
             )
             # min_score = math.floor(min(s) * 100)
             # max_score = math.ceil( max(s) * 100)
-            for score in s:
-                c.append(colors[int(round((score - zlimits[0]) * 100))])
-            #     try:
-            #     except:
-            #         print(score, min_score, max_score, len(colors))
+            color_idx = np.rint((scores - zlimits[0]) * 100).astype(int)
+            np.clip(color_idx, 0, len(colors) - 1, out=color_idx)
+            c = colors_array[color_idx].tolist()
             max_y = max(y)
             # y = [ float(y_value) / float(max_y) for y_value in y ]
             if xlimits is None:
@@ -913,30 +1405,32 @@ class Results(dict):
             if n != len(key_list) - 1:
                 params["xaxt"] = "n"
             # print(params)
-            graphics.plot(
-                robjects.FloatVector(x),
-                robjects.FloatVector(y),
-                type="l",
-                lwd=0.2,
-                col="grey",
-                **params
-            )
+            # the vectors are converted to R once for the line and the points
+            x_vector = robjects.FloatVector(x)
+            y_vector = robjects.FloatVector(y)
+            graphics.plot(x_vector, y_vector, type="l", lwd=0.2, col="grey", **params)
 
             graphics.points(
-                robjects.FloatVector(x),
-                robjects.FloatVector(y),
-                col=robjects.StrVector(c),
-                lwd=0.1,
-                **params
+                x_vector, y_vector, col=robjects.StrVector(c), lwd=0.1, **params
             )
 
             if xlimits[-1] - xlimits[0] < 10:
                 step = 1
             else:
                 step = 10
-            for k in range(math.ceil(xlimits[0]), math.floor(xlimits[-1]), step):
+            # abline draws all vertical lines of the vector v in one call
+            grid_rts = [
+                float(k)
+                for k in range(math.ceil(xlimits[0]), math.floor(xlimits[-1]), step)
+            ]
+            if len(grid_rts) > 0:
                 graphics.abline(
-                    **{"v": float(k), "col": "gray", "lty": "dashed", "lwd": 0.4}
+                    **{
+                        "v": robjects.FloatVector(grid_rts),
+                        "col": "gray",
+                        "lty": "dashed",
+                        "lwd": 0.4,
+                    }
                 )
 
             if additional_legend is not None:
@@ -1049,18 +1543,21 @@ class Results(dict):
                 if e == element:
                     break
             formated_percentile = round(float(percentile), 3)
-            for entry in value_dict["data"]:
-                formated_score = round(entry.score, 3)
+            # only scores and scaling factors are needed, not the match tuples
+            data = value_dict["data"]
+            for score, scaling_factor in zip(
+                data.scores_view().tolist(), data.scaling_factors_view().tolist()
+            ):
+                formated_score = round(score, 3)
                 p_key = (formated_percentile, formated_score)
-                try:
-                    collector[p_key]
-                except:
-                    collector[p_key] = {
+                p_dict = collector.get(p_key, None)
+                if p_dict is None:
+                    p_dict = collector[p_key] = {
                         t["percentile"]: formated_percentile,
                         t["mscore"]: formated_score,
                         t["count"]: 0,
                     }
-                collector[p_key][t["count"]] += entry.scaling_factor
+                p_dict[t["count"]] += scaling_factor
         return collector.values()
 
     def _group_silac_pairs(self, silac_pairs=None):
@@ -1074,41 +1571,36 @@ class Results(dict):
         """
         not_flipped = [target.upper() for source, target in silac_pairs]
         to_be_flipped = [source.upper() for source, target in silac_pairs]
+        # one scan per variant for any of the aa configs
+        not_flipped_re = re.compile("|".join(map(re.escape, not_flipped)))
+        to_be_flipped_re = re.compile("|".join(map(re.escape, to_be_flipped)))
+        # source aa pattern and target replacement per pair, compiled once
+        flips = []
+        for source, target in silac_pairs:
+            source_aa = source[0].upper()
+            source_state = source[1]
+            target_aa = target[0].upper()
+            target_state = target[1]
+            re_s = "(?P<SILAC>[{0}]{{1}})(?P<state>[{1}]*)".format(
+                source_aa, source_state
+            )
+            replacement = "{0}{1}".format(target_aa, target_state)
+            # the replacement is used literally
+            flips.append((re.compile(re_s), replacement.replace("\\", r"\\")))
         pairs = []
         # print(silac_pairs)
         for org_molecule, variants in self.lookup[
             "molecule fixed label variations"
         ].items():
             for variant in variants:
-                has_target_aa = False
-                for discared_AA_config in not_flipped:
-                    if discared_AA_config in variant:
-                        has_target_aa = True
-                        break
-                if has_target_aa:
+                if not_flipped_re.search(variant) is not None:
                     continue
-                has_source_aa = False
-                for hot_AA_config in to_be_flipped:
-                    if hot_AA_config in variant:
-                        has_source_aa = True
-                        break
-                if not has_source_aa:
+                if to_be_flipped_re.search(variant) is None:
                     continue
                 # print( variant )
                 pairs.append([variant])
-                for source, target in silac_pairs:
-                    source_aa = source[0].upper()
-                    source_state = source[1]
-                    target_aa = target[0].upper()
-                    target_state = target[1]
-                    re_s = "(?P<SILAC>[{0}]{{1}})(?P<state>[{1}]*)".format(
-                        source_aa, source_state
-                    )
-                    variant = re.sub(
-                        r"" + re_s,
-                        lambda match: "{0}{1}".format(target_aa, target_state),
-                        variant,
-                    )
+                for pattern, replacement in flips:
+                    variant = pattern.sub(replacement, variant)
                 pairs[-1].append(variant)
         return pairs
 
@@ -1135,6 +1627,25 @@ class Results(dict):
                         yield light_key, heavy_key
                         # exit(1)
 
+    def _iter_rt_info_file(self, rt_info_file):
+        """
+        Yields the line dicts of a quant summary/rt info csv or xlsx file,
+        csv lines are read one by one.
+        """
+        if rt_info_file.endswith(".csv"):
+            with codecs.open(rt_info_file, mode="r", encoding="utf-8") as rif:
+                yield from csv.DictReader(rif)
+        elif rt_info_file.endswith(".xlsx"):
+            # read xlsx
+            yield from pyqms.adaptors.read_xlsx_file(rt_info_file)
+        else:
+            print(
+                "Extension: {0} of file {1} not recognized".format(
+                    rt_info_file.split(".")[-1], rt_info_file
+                )
+            )
+            exit(1)
+
     def calc_amounts_from_rt_info_file(
         self,
         rt_info_file=None,
@@ -1191,24 +1702,8 @@ class Results(dict):
 
         """
         if rt_info_file is not None:
-
-            tmp_csv_dicts = []
-            # csv_reader
-            if rt_info_file.endswith(".csv"):
-                with codecs.open(rt_info_file, mode="r", encoding="utf-8") as rif:
-                    dict_reader = csv.DictReader(rif)
-                    for line_dict in dict_reader:
-                        tmp_csv_dicts.append(line_dict)
-            elif rt_info_file.endswith(".xlsx"):
-                # read xlsx
-                tmp_csv_dicts = pyqms.adaptors.read_xlsx_file(rt_info_file)
-            else:
-                print(
-                    "Extension: {0} of file {1} not recognized".format(
-                        rt_info_file.split(".")[-1], rt_info_file
-                    )
-                )
-                exit(1)
+            # rows are processed while the csv is read
+            tmp_csv_dicts = self._iter_rt_info_file(rt_info_file)
         elif buffered_csv_dicts is not None:
             tmp_csv_dicts = buffered_csv_dicts
         else:
@@ -1237,26 +1732,21 @@ class Results(dict):
                     int(line_dict["charge"]),
                     label_percentiles,
                 )
-                obj_for_calc_amount = {"rt": [], "i": [], "scores": [], "spec_ids": []}
                 # calculate the lists and pass to the calc amoutn fucntion...
-                for entry in self[m_key]["data"]:
-                    try:
-                        if entry.rt[1] == "second":
-                            rt = entry.rt[0] / 60
-                        elif entry.rt[1] == "minute":
-                            rt = entry.rt[0]
-                    except TypeError:
-                        rt = entry.rt
-
-                    if rt < line_dict["start (min)"]:  # i.e. start of rt window
-                        continue
-                    elif rt > line_dict["stop (min)"]:  # i.e. end of rt window
-                        break
-                    else:
-                        obj_for_calc_amount["rt"].append(rt)
-                        obj_for_calc_amount["i"].append(entry.scaling_factor)
-                        obj_for_calc_amount["scores"].append(entry.score)
-                        obj_for_calc_amount["spec_ids"].append(entry.spec_id)
+                data = self[m_key]["data"]
+                rts = data.rt_minutes()
+                # matches are in rt order, i.e. the window ends before the
+                # first match after the stop of the window
+                after_window = np.flatnonzero(rts > line_dict["stop (min)"])
+                if len(after_window) > 0:
+                    rts = rts[: after_window[0]]
+                in_window = np.flatnonzero(rts >= line_dict["start (min)"])
+                obj_for_calc_amount = {
+                    "rt": rts[in_window].tolist(),
+                    "i": data.scaling_factors_view()[in_window].tolist(),
+                    "scores": data.scores_view()[in_window].tolist(),
+                    "spec_ids": [data.spec_id[i] for i in in_window.tolist()],
+                }
 
                 # if len(obj_for_calc_amount['i']) < min_profile_length:
                 #     #check that at least one spec was added
@@ -1299,92 +1789,26 @@ class Results(dict):
                         )
         return rt_border_lookup, molecule_lookup
 
-    def write_rt_info_file(
-        self,
-        output_file=None,
-        list_of_csvdicts=None,
-        trivial_name_lookup=None,
-        rt_border_tolerance=None,
-        update=True,
-        buffer_only=False,
+    def _iter_rt_info_rows(
+        self, list_of_csvdicts, trivial_name_lookup, rt_border_tolerance, update
     ):
         """
-        Function to write a default quant summary/rt info file. See e.g.
-        example script generate_quant_summary_file.py.
-
-        Args:
-            output_file (str): output file name of the csv, should be a
-                complete path
-            list_of_csvdicts (list): list of dictionaries passed to the
-                DictWriter class, default fieldnames can be found below
-            trivial_name_lookup (dict): self defined trivial_name_lookup, see
-                format below.
-            rt_border_tolerance (int): retention time border tolerance in
-                minutes
-            update (bool): if True read in or passed dictionaries in
-                list_of_csvdicts will be updated with default evidence and
-                trivial name information
-
-        The quant summary file can manually be updated (e.g. the start and stop
-        RT information). If an evidence lookup is present in the result class (
-        can be passed to the isotopologue library or later be set in the result
-        class), these information are used to define the retention time borders
-        (e.g. peptide identfication information from peptide spectrum matches).
-
-        Default fieldnames:
-
-            * file_name               : filename of spectrum input file
-            * formula                 : molecular formula of the molecule
-            * molecule                : molecule or trivial name
-            * trivial_name(s)         : protein or trivial names
-            * label_percentiles       : labeling percentile ( (element, enrichment in %), )
-            * charge                  : charge of the molecule
-            * start (min)             : start of retention time window
-            * stop (min)              : stop of retention time window
-            * max I in window         : maximum intensity in retention time window
-            * max I in window (rt)    : retention time @ maximum intensity in retention time window
-            * max I in window (score) : score @ maximum intensity in retention time window
-            * auc in window           : area under curve in retention time window
-            * sum I in window         : summed up intensities in retention time window
-            * evidences (min)         : all evidences/identifications (score@rt;...)
-
-        Trivial name lookup example::
-
-            {
-                'C(33)H(59)14N(1)N(8)O(9)S(1)' : ['BSA','Bovine serum albumine']
-            }
-
+        Yields the rows of the quant summary/rt info file, see
+        write_rt_info_file. With update, a row is yielded per molecule of the
+        formula of a line dict, completed by the evidence and trivial name
+        information.
         """
-        assert output_file is not None, "You need to specify an output file"
-
-        if rt_border_tolerance is None:
-            rt_border_tolerance = 0
-
-        if list_of_csvdicts is None:
-            list_of_csvdicts = []
-            for m_key in sorted(self.keys()):
-                tmp = m_key._asdict()
-                list_of_csvdicts.append(tmp)
-
-        if trivial_name_lookup is None:
-            trivial_name_lookup = {}
-
-        csv_kwargs = {"extrasaction": "ignore"}
-        if sys.platform == "win32":
-            csv_kwargs["lineterminator"] = "\n"
-        else:
-            csv_kwargs["lineterminator"] = "\r\n"
-
         (
             full_rt_border_lookup,
             full_molecule_lookup,
         ) = self._determine_rt_windows_from_evidence(
             rt_border_tolerance=rt_border_tolerance
         )
-        lines_2_write = []
+        formula_to_molecule = self.lookup.get("formula to molecule", {})
         for tmp in list_of_csvdicts:
             if update:
-                trivial_names = trivial_name_lookup.get(tmp["formula"], [])
+                formula = tmp["formula"]
+                trivial_names = trivial_name_lookup.get(formula, [])
                 current_trivial_name = tmp.get("trivial_name(s)", None)
                 if current_trivial_name is None:
                     tmp["trivial_name(s)"] = ", ".join(trivial_names)
@@ -1394,19 +1818,16 @@ class Results(dict):
                     pass
 
                 evidence_lookup_present = False
-                if tmp["formula"] in full_rt_border_lookup.keys():
-                    if len(full_rt_border_lookup[tmp["formula"]].keys()) > 0:
-                        rt_border_lookup = full_rt_border_lookup[tmp["formula"]]
-                        molecule_list = full_molecule_lookup[tmp["formula"]]
-                        evidence_lookup_present = True
-                        tmp_evidence_dict = self.lookup["formula to evidences"].get(
-                            tmp["formula"], None
-                        )
+                rt_border_lookup = full_rt_border_lookup.get(formula, {})
+                if len(rt_border_lookup) > 0:
+                    molecule_list = full_molecule_lookup[formula]
+                    evidence_lookup_present = True
+                    tmp_evidence_dict = self.lookup["formula to evidences"].get(
+                        formula, None
+                    )
 
                 if evidence_lookup_present is False:
-                    molecule_list = self.lookup["formula to molecule"].get(
-                        tmp["formula"], []
-                    )
+                    molecule_list = formula_to_molecule.get(formula, [])
                 for molecule in molecule_list:
                     tmp["molecule"] = molecule
                     if evidence_lookup_present is True:
@@ -1414,10 +1835,9 @@ class Results(dict):
                         # 'stop (min)',
                         # 'evidences (min)'
                         # all_evidence_rts = []
+                        molecule_evidences = tmp_evidence_dict[molecule]
                         evidence_info_string_list = []
-                        for evidence_info_dict in tmp_evidence_dict[molecule][
-                            "evidences"
-                        ]:
+                        for evidence_info_dict in molecule_evidences["evidences"]:
                             """
                             {
                                 'RT'          : float(line_dict['Retention Time (s)']) / 60.0, # always in min
@@ -1443,19 +1863,20 @@ class Results(dict):
                             )
 
                         # get info from rt_border_lookup, do it like this:
-                        if len(rt_border_lookup.keys()) > 0:
-                            lower_border_tolerance = rt_border_lookup[molecule].get(
+                        if len(rt_border_lookup) > 0:
+                            molecule_rt_borders = rt_border_lookup[molecule]
+                            lower_border_tolerance = molecule_rt_borders.get(
                                 "lower_window_border", rt_border_tolerance
                             )
-                            upper_border_tolerance = rt_border_lookup[molecule].get(
+                            upper_border_tolerance = molecule_rt_borders.get(
                                 "upper_window_border", rt_border_tolerance
                             )
                             tmp["start (min)"] = (
-                                rt_border_lookup[molecule]["rt_window"][0]
+                                molecule_rt_borders["rt_window"][0]
                                 - lower_border_tolerance
                             )
                             tmp["stop (min)"] = (
-                                rt_border_lookup[molecule]["rt_window"][1]
+                                molecule_rt_borders["rt_window"][1]
                                 + upper_border_tolerance
                             )
 
@@ -1467,58 +1888,131 @@ class Results(dict):
                         tmp["evidences (min)"] = ";".join(
                             [i[1] for i in sorted(evidence_info_string_list)]
                         )
-                        if len(tmp_evidence_dict[molecule]["trivial_names"]) > 0:
+                        if len(molecule_evidences["trivial_names"]) > 0:
                             tmp["trivial_name(s)"] = ";".join(
-                                sorted(
-                                    list(
-                                        set(
-                                            tmp_evidence_dict[molecule]["trivial_names"]
-                                        )
-                                    )
-                                )
+                                sorted(set(molecule_evidences["trivial_names"]))
                             )
                         # if len()
-                    lines_2_write.append(copy.deepcopy(tmp))
+                    yield tmp.copy()
                     # csv_output.writerow( tmp )
             else:
-                lines_2_write.append(copy.deepcopy(tmp))
+                yield tmp.copy()
                 # csv_output.writerow( tmp )
-        # print(lines_2_write)
+
+    def write_rt_info_file(
+        self,
+        output_file=None,
+        list_of_csvdicts=None,
+        trivial_name_lookup=None,
+        rt_border_tolerance=None,
+        update=True,
+        buffer_only=False,
+    ):
+        """
+        Function to write a default quant summary/rt info file. See e.g.
+        example script generate_quant_summary_file.py.
+
+        Args:
+            output_file (str): output file name of the csv, should be a
+                complete path
+            list_of_csvdicts (list): list of dictionaries passed to the
+                DictWriter class, default fieldnames can be found below
+            trivial_name_lookup (dict): self defined trivial_name_lookup, see
+                format below.
+            rt_border_tolerance (int): retention time border tolerance in
+                minutes
+            update (bool): if True read in or passed dictionaries in
+                list_of_csvdicts will be updated with default evidence and
+                trivial name information
+
+        The quant summary file can manually be updated (e.g. the start and stop
+        RT information). If an evidence lookup is present in the result class (
+        can be passed to the isotopologue library or later be set in the result
+        class), these information are used to define the retention time borders
+        (e.g. peptide identfication information from peptide spectrum matches).
+
+        Default fieldnames:
+
+            * file_name               : filename of spectrum input file
+            * formula                 : molecular formula of the molecule
+            * molecule                : molecule or trivial name
+            * trivial_name(s)         : protein or trivial names
+            * label_percentiles       : labeling percentile ( (element, enrichment in %), )
+            * charge                  : charge of the molecule
+            * start (min)             : start of retention time window
+            * stop (min)              : stop of retention time window
+            * max I in window         : maximum intensity in retention time window
+            * max I in window (rt)    : retention time @ maximum intensity in retention time window
+            * max I in window (score) : score @ maximum intensity in retention time window
+            * auc in window           : area under curve in retention time window
+            * sum I in window         : summed up intensities in retention time window
+            * evidences (min)         : all evidences/identifications (score@rt;...)
+
+        Trivial name lookup example::
+
+            {
+                'C(33)H(59)14N(1)N(8)O(9)S(1)' : ['BSA','Bovine serum albumine']
+            }
+
+        """
+        assert output_file is not None, "You need to specify an output file"
+
+        if rt_border_tolerance is None:
+            rt_border_tolerance = 0
+
+        if list_of_csvdicts is None:
+            list_of_csvdicts = []
+            for m_key in sorted(self.keys()):
+                tmp = m_key._asdict()
+                list_of_csvdicts.append(tmp)
+
+        if trivial_name_lookup is None:
+            trivial_name_lookup = {}
+
+        csv_kwargs = {"extrasaction": "ignore"}
+        if sys.platform == "win32":
+            csv_kwargs["lineterminator"] = "\n"
+        else:
+            csv_kwargs["lineterminator"] = "\r\n"
+
+        rows = self._iter_rt_info_rows(
+            list_of_csvdicts, trivial_name_lookup, rt_border_tolerance, update
+        )
+        # rows are written as they are built
+        lines_2_write = []
         # default, write csv
-        if buffer_only is False:
-            if output_file.endswith(".csv"):
-                with codecs.open(output_file, mode="w", encoding="utf-8") as infof:
-                    csv_output = csv.DictWriter(
-                        infof, default_amount_csv_fieldnames, **csv_kwargs
-                    )
-                    csv_output.writeheader()
-                    for tmp in lines_2_write:
-                        csv_output.writerow(tmp)
-            elif output_file.endswith("xlsx"):
-                # write xlsx
-                try:
-                    from openpyxl import Workbook
-                except:
-                    print("openpyxl is not installed, please install it and try again")
-                    print("pip3.4 install openpyxl")
-                    sys.exit(1)
-                wb = Workbook()
-                ws = wb.active
-
-                for header_index, header in enumerate(default_amount_csv_fieldnames):
-                    header_cell = ws.cell(row=1, column=header_index + 1)
-                    header_cell.value = header
-
-                row_counter = 2
-                for tmp in lines_2_write:
-                    for column, key in enumerate(default_amount_csv_fieldnames):
-                        cell = ws.cell(row=row_counter, column=column + 1)
-                        value_2_write = tmp.get(key, "")
-                        cell.value = str(value_2_write)
-                    row_counter += 1
-
-                wb.save(output_file)
-            else:
+        if buffer_only is False and output_file.endswith(".csv"):
+            with codecs.open(output_file, mode="w", encoding="utf-8") as infof:
+                csv_output = csv.DictWriter(
+                    infof, default_amount_csv_fieldnames, **csv_kwargs
+                )
+                csv_output.writeheader()
+                for tmp in rows:
+                    lines_2_write.append(tmp)
+                    csv_output.writerow(tmp)
+        elif buffer_only is False and output_file.endswith("xlsx"):
+            # write xlsx
+            try:
+                from openpyxl import Workbook
+            except:
+                print("openpyxl is not installed, please install it and try again")
+                print("pip3.4 install openpyxl")
+                sys.exit(1)
+            wb = Workbook()
+            ws = wb.active
+
+            # whole rows are appended, not cell by cell
+            ws.append(default_amount_csv_fieldnames)
+            for tmp in rows:
+                lines_2_write.append(tmp)
+                ws.append(
+                    [str(tmp.get(key, "")) for key in default_amount_csv_fieldnames]
+                )
+
+            wb.save(output_file)
+        else:
+            lines_2_write.extend(rows)
+            if buffer_only is False:
                 print(
                     "Extension: {0} of file {1} not recognized".format(
                         output_file.split(".")[-1], output_file
@@ -1567,43 +2061,49 @@ class Results(dict):
             "#exp. peaks",
             "#obs. peaks",
         ]
+        formula_to_molecule = self.lookup["formula to molecule"]
         map_formulas = False
-        if len(self.lookup["formula to molecule"].values()) > 1:
+        if len(formula_to_molecule) > 1:
             map_formulas = True
 
-        evidence_lookup_present = False
-        if "formula to evidences" in self.lookup.keys():
-            evidence_lookup_present = True
+        # formulas without evidences and results without evidence lookup
+        # have no evidence dict
+        formula_to_evidences = self.lookup.get("formula to evidences", {})
         if output_file_name is None:
             output_file_name = "pyQms_results.csv"
         with codecs.open(output_file_name, mode="w", encoding="utf-8") as out_csv:
             csv_out = csv.DictWriter(out_csv, raw_amounts_fieldnames)
             csv_out.writeheader()
             for key, v_list in self.items():
-                if evidence_lookup_present:
-                    tmp_evidence_dict = self.lookup["formula to evidences"].get(
-                        key.formula, None
-                    )
-                else:
-                    tmp_evidence_dict = None
-                for v in v_list["data"]:
+                tmp_evidence_dict = formula_to_evidences.get(key.formula, None)
+                # the columns are read directly, no match tuples with peaks
+                data = v_list["data"]
+                exp_peaks, obs_peaks = data.peak_counts()
+                for spec_id, rt, score, scaling_factor, n_exp, n_obs in zip(
+                    data.spec_id,
+                    data.rt,
+                    data.scores_view().tolist(),
+                    data.scaling_factors_view().tolist(),
+                    exp_peaks.tolist(),
+                    obs_peaks.tolist(),
+                ):
                     dict2write = {
                         "formula": key.formula,
                         "molecule": None,
                         "charge": key.charge,
-                        "scan_id": v.spec_id,
+                        "scan_id": spec_id,
                         "label_percentiles": key.label_percentiles,
-                        "intensity": v.scaling_factor,
-                        "retention_time": v.rt,
-                        "mScore": v.score,
+                        "intensity": scaling_factor,
+                        "retention_time": rt,
+                        "mScore": score,
                         "file_name": key.file_name,
-                        "#exp. peaks": len(v.peaks),
-                        "#obs. peaks": len([x for x in v.peaks if x[0] is not None]),
+                        "#exp. peaks": n_exp,
+                        "#obs. peaks": n_obs,
                     }
                     if map_formulas is False:
                         csv_out.writerow(dict2write)
                     else:
-                        for molecule in self.lookup["formula to molecule"][key.formula]:
+                        for molecule in formula_to_molecule[key.formula]:
                             dict2write["molecule"] = molecule
                             if tmp_evidence_dict is not None:
                                 if molecule in tmp_evidence_dict.keys():
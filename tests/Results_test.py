@@ -67,6 +67,60 @@ class TestResults(unittest.TestCase):
         assert len(tmp_results.keys()) == 1
         return
 
+    def match_store_test(self):
+        key = ("BSA1.mzML", "C(37)H(59)N(9)O(16)", 2, (("N", "0.000"),))
+        data = self.results[key]["data"]
+        assert len(data) == 2
+        assert [entry.spec_id for entry in data] == [1337, 1338]
+        assert data[-1].score == 0.9
+        assert data[0].peaks == ((443.7112649, 100, 1, 443.7112649, 1),)
+        assert repr(data[0].peaks) == "((443.7112649, 100.0, 1.0, 443.7112649, 1.0),)"
+        assert len(set(data)) == 2
+        assert data.scores_view().tolist() == [1, 0.9]
+        assert data.max_score() == (1, 0)
+        self.results.add(key, (1339, 13.39, 1.5, 100, [(None, None, 1, 443.7, 1)]))
+        assert data.max_score() == (1.5, 2)
+        exp_peaks, obs_peaks = data.peak_counts()
+        assert exp_peaks.tolist() == [1, 1, 1]
+        assert obs_peaks.tolist() == [1, 1, 0]
+        # peak types of stored matches do not depend on later matches
+        self.results.add(key, (1340, 13.4, 1, 100, [(443.7, 10.5, 1, 443.7, 1)]))
+        assert repr(data[0].peaks) == "((443.7112649, 100.0, 1.0, 443.7112649, 1.0),)"
+
+        unpickled = pickle.loads(pickle.dumps(self.results))
+        assert list(unpickled.values())[0]["data"][1] == data[1]
+        return
+
+    def matched_values_test(self):
+        lib = pyqms.IsotopologueLibrary(
+            molecules=["KLEINERTEST"], charges=[2], verbose=False
+        )
+        results = pyqms.Results(lookup=lib.lookup, params=lib.params)
+        added = []
+        results_add = results.add
+
+        def add(key, value):
+            added.append((results_add(key, value), value))
+
+        results.add = add
+        for formula in lib.keys():
+            env = lib[formula]["env"][(("N", "0.000"),)]
+            spectrum = sorted(zip(env[2]["mz"], env["abun"]))
+            lib.match_all(
+                mz_i_list=spectrum,
+                file_name="test.mzML",
+                spec_id=1,
+                spec_rt=1.0,
+                results=results,
+            )
+        assert len(added) == 1
+        for key, value in added:
+            # stored matches are the tuples match_isotopologue returned
+            entry = results[key]["data"][0]
+            assert entry == value
+            assert hash(entry) == hash(value)
+        return
+
     def parse_and_filter_test(self):
         """
         def _parse_and_filter(
@@ -107,6 +161,27 @@ class TestResults(unittest.TestCase):
 
         return
 
+    def result_index_test(self):
+        unindexed_results = pyqms.Results(
+            lookup=self.results.lookup, params={"BUILD_RESULT_INDEX": False}
+        )
+        for key in self.results.keys():
+            for entry in self.results[key]["data"]:
+                unindexed_results.add(key, entry)
+        assert len(unindexed_results.index["key positions"]) == 0
+        assert self.results.index["keys by"]["charge"][3] == [
+            ("BSA2.mzML", "C(43)H(75)N(15)O(17)S(2)", 3, (("N", "0.010"),))
+        ]
+        for kwargs in [
+            {"charges": [2, 3]},
+            {"molecules": ["DDSPDLPK"], "file_names": ["BSA1.mzML"]},
+            {"file_names": ["BSA2.mzML"], "charges": [2]},
+        ]:
+            assert list(self.results._parse_and_filter(**kwargs)) == list(
+                unindexed_results._parse_and_filter(**kwargs)
+            )
+        return
+
     def extract_results_test(self):
         """
         extract_results(
@@ -152,6 +227,19 @@ class TestResults(unittest.TestCase):
             # print(self.results.lookup)
             assert n == 0
 
+    def extract_results_batch_test(self):
+        keys, entries = self.results.extract_results_batch(score_threshold=0.95)
+        assert len(keys) == 2
+        assert len(entries) == 2
+        assert keys[entries.key_idx[0]].file_name == "BSA1.mzML"
+        assert entries.idx.tolist() == [0, 0]
+        assert entries.rt.tolist() == [13.37, 13.37]
+        assert entries.scaling_factor.tolist() == [100, 10]
+
+        keys, entries = self.results.extract_results_batch(molecules=["DDSPDLPK"])
+        assert entries.score.tolist() == [1, 0.9]
+        return
+
     def extract_format_results_test(self):
         """
         format_results(
@@ -210,6 +298,7 @@ class TestResults(unittest.TestCase):
             values = self.results.format_all_results()
 
             assert isinstance(values, pd.DataFrame)
+            assert values["file_name"].dtype == "category"
 
             for out_data in test_dict["output"]:
                 result = values.loc[
@@ -231,6 +320,11 @@ class TestResults(unittest.TestCase):
             ["DDSPDLPK"], ["C(37)H(59)N(9)O(16)"]
         ) == set(["C(37)H(59)N(9)O(16)"])
 
+        assert self.results._translate_molecules_to_formulas(["KLEINER"], None) == set()
+        self.results.lookup["molecule to formula"]["KLEINER"] = "C(1)"
+        assert self.results._translate_molecules_to_formulas(["KLEINER"], None) == set(
+            ["C(1)"]
+        )
         return
 
     def max_score_test(self):
@@ -345,6 +439,17 @@ class TestResults(unittest.TestCase):
                     plot=True,
                 )
 
+    def colorize_score_test(self):
+        results = pyqms.Results(params={"COLORS": {0: (0, 0, 0), 1: (10, 200, 0)}})
+        assert results.colorize_score(0.5) == ((5, 100, 0), "#056400")
+        assert results.colorize_score(0.504) == results.colorize_score(0.5)
+        assert results.colorize_score(2) == ((10, 200, 0), "#0ac800")
+        assert results.colorize_score(None) == ((0, 0, 0), "#000000")
+        # colors are interpolated again if params['COLORS'] changed
+        results.params["COLORS"] = {0: (0, 0, 0), 1: (200, 200, 200)}
+        assert results.colorize_score(0.5) == ((100, 100, 100), "#646464")
+        return
+
     def intensity_transformation_test(self):
         # normal way, no change
         i_label, i_transform_function = self.results._define_i_transformation()
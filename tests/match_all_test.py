@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+
+Testfunctions to test match_all from core
+
+"""
+
+import gc
+import pickle
+import random
+import numpy as np
+import pyqms
+
+
+MOLECULES = ["PEPTIDE", "PAINLESS", "ELVISLIVES", "KLEINERTEST", "TESTPEPTIDE"]
+
+
+def build_library(params):
+    params.setdefault("MAX_MOLECULES_PER_MATCH_BIN", 2)
+    return pyqms.IsotopologueLibrary(
+        molecules=MOLECULES,
+        charges=[2, 3],
+        metabolic_labels={"15N": [0, 0.5]},
+        params=params,
+        verbose=False,
+    )
+
+
+def build_spectrum(lib, candidates_per_peak=1):
+    """
+    Spectrum with peaks close to the isotopologues of all molecules in lib,
+    candidates_per_peak measured peaks within +-4 ppm per isotope.
+    """
+    rng = random.Random(1)
+    spectrum = []
+    for formula in sorted(lib.keys()):
+        for label_percentile, envelope in sorted(lib[formula]["env"].items()):
+            for charge in [2, 3]:
+                for mz, abun in zip(envelope[charge]["mz"], envelope["abun"]):
+                    for _ in range(candidates_per_peak):
+                        spectrum.append(
+                            (
+                                mz * (1 + rng.uniform(-4e-6, 4e-6)),
+                                abun * rng.uniform(0.5, 1.5),
+                            )
+                        )
+    spectrum.sort()
+    return spectrum
+
+
+def matches(lib, spectrum):
+    results = lib.match_all(mz_i_list=spectrum, file_name="test", spec_id=1, spec_rt=1)
+    return sorted(
+        (key.formula, key.charge, key.label_percentiles, match)
+        for key, i, match in results.extract_results()
+    )
+
+
+def stream_match_sets_test():
+    lib = build_library({})
+    streamed_lib = build_library({"STREAM_MATCH_SETS": True})
+    assert len(streamed_lib.match_sets) > 1
+    spectrum = build_spectrum(lib)
+    expected = matches(lib, spectrum)
+    assert len(expected) > 0
+    assert matches(streamed_lib, spectrum) == expected
+    assert matches(streamed_lib, np.array(spectrum)) == expected
+
+
+def streamed_match_set_test():
+    lib = build_library({})
+    streamed_lib = build_library({"STREAM_MATCH_SETS": True})
+    for package_number, match_set in lib.match_sets.items():
+        streamed_match_set = streamed_lib.match_sets[package_number]
+        assert sorted(streamed_match_set.keys()) == sorted(match_set.keys())
+        assert "tmzs" in streamed_match_set
+        for key in ("tmzs", "tmz_ranges"):
+            assert (streamed_match_set.get(key) == match_set[key]).all()
+            assert streamed_match_set[key] is streamed_match_set[key]
+
+
+def pickled_streamed_library_test():
+    streamed_lib = build_library({"STREAM_MATCH_SETS": True})
+    spectrum = build_spectrum(streamed_lib)
+    expected = matches(streamed_lib, spectrum)
+    unpickled_lib = pickle.loads(pickle.dumps(streamed_lib))
+    del streamed_lib
+    gc.collect()
+    assert matches(unpickled_lib, spectrum) == expected
+
+
+def exhaustive_combo_search_test():
+    lib = build_library({})
+    assert lib.params["EXHAUSTIVE_COMBO_SEARCH"] is True
+    greedy_lib = build_library({"EXHAUSTIVE_COMBO_SEARCH": False})
+    spectrum = build_spectrum(lib, candidates_per_peak=3)
+    exhaustive_matches = matches(lib, spectrum)
+    greedy_matches = matches(greedy_lib, spectrum)
+    assert len(exhaustive_matches) > 0
+    assert len(greedy_matches) <= len(exhaustive_matches)
+    best_scores = {entry[:3]: entry[3].score for entry in exhaustive_matches}
+    higher_scores = 0
+    for formula, charge, label_percentiles, match in greedy_matches:
+        best_score = best_scores[(formula, charge, label_percentiles)]
+        assert match.score <= best_score
+        if match.score < best_score:
+            higher_scores += 1
+    # the modes differ if there are several candidates per peak ...
+    assert higher_scores > 0
+    # ... and agree if there is only one
+    spectrum = build_spectrum(lib)
+    assert matches(greedy_lib, spectrum) == matches(lib, spectrum)
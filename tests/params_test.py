@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+
+Test pyqms.params
+
+"""
+import numpy as np
+import pyqms
+from pyqms.params import (
+    get_params_descriptions,
+    get_param_index,
+    get_param_table,
+    get_params_fingerprint,
+    PARAMS_FINGERPRINT,
+    ParamBundle,
+    PARAMS_VALIDATED,
+)
+import unittest
+
+
+class TestParams(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def read_only_test(self):
+        with self.assertRaises(TypeError):
+            pyqms.params["REL_MZ_RANGE"] = 1e-6
+        with self.assertRaises(TypeError):
+            pyqms.params["FIXED_LABEL_ISOTOPE_ENRICHMENT_LEVELS"]["15N"] = 0.5
+
+    def library_params_are_mutable_copy_test(self):
+        lib = pyqms.IsotopologueLibrary(
+            molecules=["KLEINERTEST"],
+            charges=[2],
+            params={"REL_MZ_RANGE": 1e-6},
+            verbose=False,
+        )
+        self.assertEqual(lib.params["REL_MZ_RANGE"], 1e-6)
+        self.assertEqual(pyqms.params["REL_MZ_RANGE"], 5e-6)
+        lib.params["FIXED_LABEL_ISOTOPE_ENRICHMENT_LEVELS"]["18O"] = 0.99
+        self.assertNotIn("18O", pyqms.params["FIXED_LABEL_ISOTOPE_ENRICHMENT_LEVELS"])
+
+    def description_defaults_test(self):
+        for entries in get_params_descriptions().values():
+            for entry in entries:
+                self.assertEqual(entry["default"], pyqms.params[entry["key"]])
+                self.assertNotIn("\n", entry["description"])
+
+    def param_index_test(self):
+        section, entry = get_param_index()["REL_MZ_RANGE"]
+        self.assertEqual(section, "matching_and_scoring")
+        self.assertEqual(entry["key"], "REL_MZ_RANGE")
+        self.assertEqual(
+            len(get_param_index()),
+            sum(len(e) for e in get_params_descriptions().values()),
+        )
+
+    def param_table_test(self):
+        table = get_param_table()
+        self.assertEqual(len(table), len(get_param_index()))
+        for record in table:
+            section, entry = get_param_index()[record["key"]]
+            self.assertEqual(record["section"], section)
+            self.assertEqual(record["default"], entry["default"])
+            self.assertEqual(record["description"], entry["description"])
+
+    def params_fingerprint_test(self):
+        lib = pyqms.IsotopologueLibrary(
+            molecules=["KLEINERTEST"], charges=[2], verbose=False
+        )
+        self.assertEqual(get_params_fingerprint(lib.params), PARAMS_FINGERPRINT)
+        lib.params["REL_MZ_RANGE"] = 1e-6
+        self.assertNotEqual(get_params_fingerprint(lib.params), PARAMS_FINGERPRINT)
+
+    def validate_params_test(self):
+        self.assertTrue(PARAMS_VALIDATED)
+        with self.assertRaises(ValueError):
+            pyqms.IsotopologueLibrary(
+                molecules=["KLEINERTEST"],
+                charges=[2],
+                params={"REL_MZ_RANGE": 5},
+                verbose=False,
+            )
+        with self.assertRaises(ValueError):
+            pyqms.IsotopologueLibrary(
+                molecules=["KLEINERTEST"],
+                charges=[2],
+                params={"MINIMUM_NUMBER_OF_MATCHED_ISOTOPOLOGUES": "2"},
+                verbose=False,
+            )
+        with self.assertRaises(ValueError):
+            pyqms.IsotopologueLibrary(
+                molecules=["KLEINERTEST"],
+                charges=[2],
+                params={"MINIMUM_NUMBER_OF_MATCHED_ISOTOPOLOGUES": True},
+                verbose=False,
+            )
+        lib = pyqms.IsotopologueLibrary(
+            molecules=["KLEINERTEST"],
+            charges=[2],
+            params={
+                "MINIMUM_NUMBER_OF_MATCHED_ISOTOPOLOGUES": np.int64(3),
+                "REL_MZ_RANGE": np.float32(5e-6),
+            },
+            verbose=False,
+        )
+        self.assertEqual(lib.params["MINIMUM_NUMBER_OF_MATCHED_ISOTOPOLOGUES"], 3)
+
+    def param_bundle_test(self):
+        bundle = ParamBundle.from_dict(pyqms.params)
+        for key in ParamBundle._fields:
+            self.assertEqual(getattr(bundle, key), pyqms.params[key])
+        with self.assertRaises(AttributeError):
+            bundle.REL_MZ_RANGE = 1e-6
+
+
+if __name__ == "__main__":
+    unittest.main()